@@ -0,0 +1,184 @@
+# End-to-end throughput benchmark: clone -> chunk -> analyze -> aggregate on synthetic repos,
+# with FakeBackend standing in for the LLM so it runs offline and is repeatable.
+#
+#   python -m benchmarks.pipeline_benchmark --sizes 25 100 400 --output bench.json
+#   python -m benchmarks.pipeline_benchmark --baseline bench.json   # exits 1 on a regression
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import resource
+import tempfile
+import threading
+import tracemalloc
+import numpy as np
+import pygit2
+from src.eval.chunker import CHUNK_WORKERS
+from src.eval.llm_backend import FakeBackend
+from src.eval.pipeline import init_repository, analyze_repository
+
+DEFAULT_SIZES = [25, 100, 400]
+STAGES = ("clone", "filter", "chunk", "analyze", "aggregate")
+REGRESSION_TOLERANCE = 0.2
+
+
+class TimedBackend:
+    def __init__(self, backend):
+        self.backend = backend
+        self.lock = threading.Lock()
+        self.latencies = []
+
+    def complete(self, *args):
+        start = time.perf_counter()
+        try:
+            return self.backend.complete(*args)
+        finally:
+            with self.lock:
+                self.latencies.append(time.perf_counter() - start)
+
+
+def synthetic_module(rng: random.Random, index: int) -> str:
+    lines = [f'"""Synthetic module {index}."""', "import math", ""]
+    for function in range(rng.randint(5, 30)):
+        args = ", ".join(f"arg{i}" for i in range(rng.randint(1, 4)))
+        lines += [f"def function_{index}_{function}({args}):", "    total = 0"]
+        for step in range(rng.randint(3, 25)):
+            kind = rng.random()
+            if kind < 0.3:
+                lines += [f"    for i in range({rng.randint(2, 50)}):", f"        total += math.sqrt(i * arg0 + {step})"]
+            elif kind < 0.6:
+                lines += [f"    if total > {rng.randint(0, 1000)}:", f"        total -= arg0 * {rng.randint(1, 9)}"]
+            else:
+                lines.append(f"    total = total * {rng.random():.3f} + {rng.randint(0, 100)}")
+        lines += ["    return total", "", ""]
+    return "\n".join(lines)
+
+
+def make_repo(path: str, files: int, seed: int) -> str:
+    rng = random.Random(seed)
+    os.makedirs(path)
+    for index in range(files):
+        package = os.path.join(path, f"package_{index % 10}")
+        os.makedirs(package, exist_ok=True)
+        with open(os.path.join(package, f"module_{index}.py"), "w") as f:
+            f.write(synthetic_module(rng, index))
+    repo = pygit2.init_repository(path)
+    repo.index.add_all()
+    repo.index.write()
+    signature = pygit2.Signature("benchmark", "benchmark@example.com")
+    repo.create_commit("HEAD", signature, signature, "synthetic repo", repo.index.write_tree(), [])
+    return path
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux; chunking runs in worker processes, which count as children
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(own / 1024, 1), round(children / 1024, 1)
+
+
+def run_size(files: int, args, workdir: str) -> dict:
+    source = make_repo(os.path.join(workdir, "sources", f"synthetic_{files}"), files, args.seed)
+    base_path = os.path.join(workdir, "clones")
+    backend = TimedBackend(FakeBackend(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                                       rate_limit_rate=args.rate_limit_rate, seed=args.seed))
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    # stage times come from the pipeline's own timed() breakdown, so each one covers exactly that stage
+    timings = {}
+    start = time.perf_counter()
+    repo_path = init_repository(source, base_path, workers=args.workers, timings=timings)
+    analyser = analyze_repository(repo_path, args.mode, max_workers=args.concurrency, rpm=None, tpm=None, backend=backend, timings=timings)
+    finished = time.perf_counter()
+
+    traced_peak = None
+    if args.tracemalloc:
+        traced_peak = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+        tracemalloc.stop()
+    rss, children_rss = peak_rss_mb()
+    latencies = np.array(backend.latencies) if backend.latencies else np.zeros(1)
+    chunks = len(analyser.load_chunks(repo_path))
+    return {
+        "files": files,
+        "chunks": chunks,
+        "analyzed_chunks": len(analyser.scores),
+        "calls": len(backend.latencies),
+        "seconds": {
+            **{stage: round(timings.get(stage, {}).get("seconds", 0.0), 3) for stage in STAGES},
+            "total": round(finished - start, 3),
+        },
+        "chunks_per_sec": round(chunks / (finished - start - timings.get("clone", {}).get("seconds", 0.0)), 2),
+        "latency_ms": {
+            "p50": round(float(np.percentile(latencies, 50)) * 1000, 1),
+            "p99": round(float(np.percentile(latencies, 99)) * 1000, 1),
+        },
+        "peak_rss_mb": rss,
+        "peak_children_rss_mb": children_rss,
+        "peak_traced_mb": traced_peak,
+    }
+
+
+def find_regressions(results, baseline, tolerance):
+    previous = {run["files"]: run for run in baseline["runs"]}
+    regressions = []
+    for run in results["runs"]:
+        old = previous.get(run["files"])
+        if old is None:
+            continue
+        if run["chunks_per_sec"] < old["chunks_per_sec"] * (1 - tolerance):
+            regressions.append(f"{run['files']} files: chunks/sec {old['chunks_per_sec']} -> {run['chunks_per_sec']}")
+        if run["latency_ms"]["p99"] > old["latency_ms"]["p99"] * (1 + tolerance):
+            regressions.append(f"{run['files']} files: p99 {old['latency_ms']['p99']}ms -> {run['latency_ms']['p99']}ms")
+        if run["peak_rss_mb"] > old["peak_rss_mb"] * (1 + tolerance):
+            regressions.append(f"{run['files']} files: peak rss {old['peak_rss_mb']}MB -> {run['peak_rss_mb']}MB")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline end-to-end pipeline benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="synthetic repo sizes, in files")
+    parser.add_argument("--mode", default="code_quality")
+    parser.add_argument("--workers", type=int, default=CHUNK_WORKERS, help="chunking processes")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent LLM calls")
+    parser.add_argument("--latency", type=float, default=0.02, help="fake LLM latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tracemalloc", action="store_true", help="also trace Python heap peaks (slower)")
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--baseline", help="earlier --output file to compare against")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="go-sail-bench-")
+    try:
+        runs = []
+        for files in sorted(args.sizes):
+            run = run_size(files, args, workdir)
+            runs.append(run)
+            print(f"{files:>6} files {run['chunks']:>7} chunks  {run['chunks_per_sec']:>8} chunks/s  "
+                  f"p50 {run['latency_ms']['p50']}ms  p99 {run['latency_ms']['p99']}ms  "
+                  f"rss {run['peak_rss_mb']}MB  {run['seconds']}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {"mode": args.mode, "latency": args.latency, "concurrency": args.concurrency, "runs": runs}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
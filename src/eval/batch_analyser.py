@@ -0,0 +1,108 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from ..models.batch_model import batch_response_model, sys_prompt_suffix
+from .chunk_store import Chunk
+from .code_analyser import CodeAnalyser, GROQ_MODEL
+from .metrics import CHUNKS_ANALYZED
+from .triage import LLM
+from .rate_limiter import estimate_tokens
+from .result_cache import ResultCache
+
+BATCH_TOKENS = 3000
+MAX_BATCH_CHUNKS = 5
+
+
+class BatchCodeAnalyser(CodeAnalyser):
+    # packs small chunks into one request up to a token budget and splits the answer back per chunk
+    def __init__(self, analysis_mode: str, batch_tokens: int = BATCH_TOKENS, max_batch_chunks: int = MAX_BATCH_CHUNKS, **kwargs):
+        super().__init__(analysis_mode, **kwargs)
+        self.batch_tokens = batch_tokens
+        self.max_batch_chunks = max_batch_chunks
+        self.batch_prompt = self.sys_prompt + sys_prompt_suffix
+        self.batch_model = batch_response_model(self.response_model)
+        self.routes = {}
+
+    def cache_key(self, chunk: Chunk, model: str = GROQ_MODEL):
+        # results in this mode come from the batch prompt, keep them apart from single-chunk ones
+        return ResultCache.make_key(chunk.text, self.analysis_mode, model, self.batch_prompt)
+
+    def dedup_variant(self):
+        return ResultCache.make_key("", self.analysis_mode, GROQ_MODEL if self.triage is None else "triage", self.batch_prompt)
+
+    def route(self, chunk: Chunk):
+        # chunks sent on alone reach process_chunk after iter_chunks already triaged them
+        return self.routes.get(chunk.id) or super().route(chunk)
+
+    def pack(self, chunks):
+        # chunks triaged away from the full model go alone, process_chunk then scores them locally or on the cheap model
+        batches, batch, used = [], [], 0
+        for chunk in sorted(chunks, key=lambda chunk: chunk.id):
+            tokens = estimate_tokens(chunk.text)
+            if tokens > self.batch_tokens // 2 or self.route(chunk)[0] != LLM:
+                batches.append([chunk])
+                continue
+            if batch and (used + tokens > self.batch_tokens or len(batch) >= self.max_batch_chunks):
+                batches.append(batch)
+                batch, used = [], 0
+            batch.append(chunk)
+            used += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def iter_chunks(self, chunks, output_folder):
+        pending = []
+        self.routes = {}
+        for chunk in chunks:
+            decision, metrics = self.routes[chunk.id] = self.route(chunk)
+            output = self.cached_output(chunk) if decision == LLM else None
+            if output is None:
+                pending.append(chunk)
+            else:
+                yield chunk, self.store_output(chunk, self.annotate(output, decision, metrics), output_folder, fresh=False)
+
+        batches = self.pack(pending)
+        self.logger.info(f"Packed {len(pending)} chunks into {len(batches)} requests")
+        executor = ThreadPoolExecutor(max_workers=self.concurrency.maximum)
+        futures = [executor.submit(self.process_batch, batch, output_folder) for batch in batches]
+        try:
+            for future in as_completed(futures):
+                yield from future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+    def batch_content(self, batch):
+        return "\n\n".join(f'<chunk id="{chunk.id}" file="{chunk.file}">\n{chunk.text}\n</chunk>' for chunk in batch)
+
+    def process_batch(self, batch, output_folder):
+        if self.cancelled():
+            return []
+        if len(batch) == 1:
+            return [(batch[0], self.process_chunk(batch[0], output_folder))]
+
+        self.logger.info(f"Processing batch of {len(batch)} chunks: {', '.join(chunk.id for chunk in batch)}")
+        try:
+            response = self.get_output(self.batch_content(batch), self.batch_prompt, self.batch_model, self.completion_tokens * len(batch))
+            results_by_id = {item.chunk_id: item.result for item in response.results}
+        except Exception as e:
+            # the request itself failed, e.g. after repeated 429s; sending every chunk alone now would multiply the
+            # load, so they fail together and come back in the retry rounds or the retry queue
+            self.logger.error(f"Error processing batch: {str(e)}")
+            CHUNKS_ANALYZED.inc(len(batch), mode=self.analysis_mode, source="error")
+            if self.on_result is not None:
+                for chunk in batch:
+                    self.on_result(chunk, None)
+            return [(chunk, None) for chunk in batch]
+
+        results = []
+        for chunk in batch:
+            result = results_by_id.get(chunk.id)
+            if result is None:
+                # dropped or misnamed by the model, fall back to a request of its own
+                self.logger.info(f"Chunk {chunk.id} missing from batch response, retrying alone")
+                results.append((chunk, self.process_chunk(chunk, output_folder)))
+            else:
+                decision, metrics = self.route(chunk)
+                results.append((chunk, self.store_output(chunk, self.annotate(result.model_dump_json(indent=2), decision, metrics), output_folder, source="batch")))
+        return results
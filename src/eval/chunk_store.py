@@ -0,0 +1,163 @@
+import os
+import json
+import mmap
+import logging
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional
+
+CHUNKS_FILE = "chunks.jsonl"
+INDEX_FILE = "index.json"
+COMPACT_MIN_BYTES = 1024 * 1024
+
+
+def chunk_file(chunk_id: str) -> str:
+    # ids are "<repo-relative path>-<n>", the suffix never contains a dash
+    return chunk_id.rsplit('-', 1)[0]
+
+
+@dataclass
+class Chunk:
+    id: str
+    file: str
+    index: int
+    language: str
+    node: dict
+    # git blob id of the source file, a free content hash when ingested from the object database
+    blob: Optional[str] = None
+
+    @property
+    def text(self) -> str:
+        return self.node.get("text", "")
+
+    @property
+    def payload(self) -> str:
+        # same string the chunker used to write per chunk (node.to_json())
+        return json.dumps(self.node)
+
+
+# append-only JSONL segment of chunk records plus an offset index, read back through mmap
+class ChunkStore:
+    def __init__(self, folder: str):
+        self.logger = logging.getLogger(__name__)
+        self.folder = str(folder)
+        self.data_path = os.path.join(self.folder, CHUNKS_FILE)
+        self.index_path = os.path.join(self.folder, INDEX_FILE)
+        self.chunks: Dict[str, List[int]] = {}
+        self.files: Dict[str, List[str]] = {}
+        self.blobs: Dict[str, str] = {}
+        self._writer = None
+        self._map = None
+        self._map_size = 0
+        self.load()
+
+    def load(self):
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+            self.chunks = index["chunks"]
+            self.files = index["files"]
+            self.blobs = index.get("blobs", {})
+
+    def save(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._garbage_bytes() > max(self._live_bytes(), COMPACT_MIN_BYTES):
+            self.compact()
+        os.makedirs(self.folder, exist_ok=True)
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"chunks": self.chunks, "files": self.files, "blobs": self.blobs}, f)
+        os.replace(tmp_path, self.index_path)
+
+    def clear(self):
+        self.close()
+        for path in (self.data_path, self.index_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.chunks = {}
+        self.files = {}
+        self.blobs = {}
+
+    def add_file(self, file: str, language: str, nodes: List[dict], blob: str = None):
+        self.remove_files([file])
+        if self._writer is None:
+            os.makedirs(self.folder, exist_ok=True)
+            self._writer = open(self.data_path, 'ab')
+        ids = []
+        for i, node in enumerate(nodes, 1):
+            chunk_id = f"{file}-{i}"
+            record = {"id": chunk_id, "file": file, "index": i, "language": language, "node": node, "blob": blob}
+            line = json.dumps(record).encode("utf-8") + b"\n"
+            offset = self._writer.tell()
+            self._writer.write(line)
+            self.chunks[chunk_id] = [offset, len(line)]
+            ids.append(chunk_id)
+        self.files[file] = ids
+        if blob is not None:
+            self.blobs[file] = blob
+
+    def remove_files(self, files) -> List[str]:
+        removed = []
+        for file in files:
+            self.blobs.pop(file, None)
+            for chunk_id in self.files.pop(file, []):
+                self.chunks.pop(chunk_id, None)
+                removed.append(chunk_id)
+        return removed
+
+    def compact(self):
+        self.logger.info(f"Compacting chunk store {self.data_path}")
+        tmp_path = self.data_path + ".tmp"
+        chunks = {}
+        with open(tmp_path, 'wb') as out:
+            for chunk_id, (offset, length) in sorted(self.chunks.items(), key=lambda item: item[1][0]):
+                chunks[chunk_id] = [out.tell(), length]
+                out.write(self._read(offset, length))
+        self._close_map()
+        os.replace(tmp_path, self.data_path)
+        self.chunks = chunks
+
+    def _live_bytes(self):
+        return sum(length for _, length in self.chunks.values())
+
+    def _garbage_bytes(self):
+        if not os.path.exists(self.data_path):
+            return 0
+        return os.path.getsize(self.data_path) - self._live_bytes()
+
+    def _read(self, offset, length) -> bytes:
+        if self._map is None or offset + length > self._map_size:
+            self._close_map()
+            with open(self.data_path, 'rb') as f:
+                self._map_size = os.fstat(f.fileno()).st_size
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map[offset:offset + length]
+
+    def _close_map(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+            self._map_size = 0
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self._close_map()
+
+    def get(self, chunk_id: str) -> Chunk:
+        offset, length = self.chunks[chunk_id]
+        return Chunk(**json.loads(self._read(offset, length)))
+
+    def iter_file(self, file: str) -> Iterator[Chunk]:
+        for chunk_id in self.files.get(file, []):
+            yield self.get(chunk_id)
+
+    def iter_chunks(self) -> Iterator[Chunk]:
+        # offset order keeps the reads sequential through the segment
+        for chunk_id, _ in sorted(self.chunks.items(), key=lambda item: item[1][0]):
+            yield self.get(chunk_id)
+
+    def __len__(self):
+        return len(self.chunks)
@@ -1,23 +1,114 @@
 #chunker.py
 import os
 import json
+import time
+import heapq
 import logging
 from pathlib import Path
+from dataclasses import replace
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pygit2
 from llama_index.core.node_parser import CodeSplitter
+from llama_index.core.schema import Document
 from llama_index.readers.file import FlatReader
 from ..eval.languages import languageExtensions
+from .chunk_store import ChunkStore
+from .file_filter import FileFilter, FilterConfig, HEAD_BYTES
+from .git_handler import GitHandler
+from .metrics import FILES_FILTERED, STAGE_ITEMS, timed
+
+# folders and files the pipeline itself writes into a repo checkout; older runs left dedup_report.json at the root
+ARTIFACT_NAMES = {".git", "chunk_data", "output_data", "file_output_mapping.json", "analysis_state.json", "dedup_report.json"}
+
+
+CHUNK_LINES = 1000
+MAX_CHARS = 6000
+BATCHES_PER_WORKER = 4
+CHUNK_WORKERS = os.cpu_count() or 1
+
+# one splitter (and tree-sitter parser) per language, per process
+_splitters = {}
+
+
+def get_splitter(language):
+    splitter = _splitters.get(language)
+    if splitter is None:
+        splitter = CodeSplitter(chunk_lines=CHUNK_LINES, language=language, max_chars=MAX_CHARS)
+        _splitters[language] = splitter
+    return splitter
+
+
+# open repositories, per process, for reading blobs without a checkout
+_repositories = {}
+
+
+def read_blob(git_dir, oid):
+    repo = _repositories.get(git_dir)
+    if repo is None:
+        repo = pygit2.Repository(git_dir)
+        _repositories[git_dir] = repo
+    return repo[oid].data.decode("utf-8", errors="replace")
+
+
+def split_file(file_path, language):
+    document = FlatReader().load_data(Path(file_path))
+    nodes = get_splitter(language).get_nodes_from_documents(document)
+    return [node.to_dict() for node in nodes]
+
+
+def split_text(text, file_name, language):
+    # same metadata FlatReader attaches, so blob and disk chunks look alike
+    document = Document(text=text, metadata={"filename": Path(file_name).name, "extension": Path(file_name).suffix})
+    nodes = get_splitter(language).get_nodes_from_documents([document])
+    return [node.to_dict() for node in nodes]
+
+
+def chunk_batch(batch, git_dir=None):
+    # worker entry point: [(rel_path, language, file path or blob id)] -> [(rel_path, language, node dicts or None, error)]
+    results = []
+    for rel_path, language, source in batch:
+        try:
+            if git_dir is None:
+                nodes = split_file(source, language)
+            else:
+                nodes = split_text(read_blob(git_dir, source), rel_path, language)
+            results.append((rel_path, language, nodes, None))
+        except Exception as e:
+            results.append((rel_path, language, None, str(e)))
+    return results
+
+
+def size_balanced_batches(items, batch_count):
+    # longest-first greedy packing of (rel_path, language, source, size) into batches of similar total size
+    heap = [(0, i, []) for i in range(batch_count)]
+    for item in sorted(items, key=lambda item: item[-1], reverse=True):
+        total, i, batch = heapq.heappop(heap)
+        batch.append(item[:-1])
+        heapq.heappush(heap, (total + item[-1], i, batch))
+    return [batch for _, _, batch in heap if batch]
+
+
+def read_head(file_path):
+    with open(file_path, 'rb') as f:
+        return f.read(HEAD_BYTES)
+
 
 class ChunkExtractor:
-    def __init__(self):
+    def __init__(self, filter_config: FilterConfig = None, progress=None, cancel_event=None, timings=None):
+        # progress(stage, done, total) is called as files complete; setting cancel_event stops the run;
+        # timings collects this run's per-stage breakdown
+        self.filter_config = filter_config or FilterConfig()
+        self.progress = progress
+        self.cancel_event = cancel_event
+        self.timings = timings
         self.logger = logging.getLogger(__name__)
-        self.logger.setLevel(logging.INFO)
-        handler = logging.StreamHandler()
-        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-        self.logger.addHandler(handler)
 
     def detectLanguage(self, filePath):
+        # whole-filename keys (Makefile, Dockerfile, go.mod) win over the extension
+        name = Path(filePath).name
+        if name in languageExtensions:
+            return languageExtensions[name]
         extension = Path(filePath).suffix[1:].lower()
-        print(languageExtensions.get(extension, 'unknown'), "\n\n\n")
         return languageExtensions.get(extension, 'unknown')
 
     def processRepos(self, root_folder):
@@ -26,41 +117,153 @@ class ChunkExtractor:
             if repo_path.is_dir():
                 self.processRepo(repo_path)
 
-    def processRepo(self, repo_path):
+    def processRepo(self, repo_path, workers=None):
+        file_filter = FileFilter(self.filter_config, ARTIFACT_NAMES)
+        # a full run replaces whatever was chunked before
+        ChunkStore(repo_path / "chunk_data").clear()
+        return self.processPaths(repo_path, file_filter.walk(str(repo_path)), file_filter, workers)
+
+    def processFiles(self, repo_path, rel_paths, workers=None):
+        file_filter = FileFilter(self.filter_config, ARTIFACT_NAMES)
+        accepted = []
+        for rel_path in rel_paths:
+            if not (repo_path / rel_path).is_file():
+                continue
+            reason = file_filter.load_rules_for(str(repo_path), rel_path)
+            if reason is None:
+                accepted.append(rel_path)
+            elif reason != "artifact":
+                file_filter.report.skip(rel_path, reason)
+        return self.processPaths(repo_path, accepted, file_filter, workers)
+
+    def processPaths(self, repo_path, rel_paths, file_filter, workers=None):
+        items = []
+        with timed("filter", self.timings):
+            for rel_path in rel_paths:
+                file_path = repo_path / rel_path
+                language = self.detectLanguage(rel_path)
+                if language == 'unknown':
+                    file_filter.report.skip(rel_path, "unknown_language")
+                    continue
+                size = file_path.stat().st_size
+                if file_filter.check(rel_path, size, lambda: read_head(file_path)):
+                    items.append((rel_path, language, str(file_path), size))
+
+        self.writeReport(repo_path, file_filter)
+        stats = self.chunkItems(repo_path, items, workers)
+        stats["skipped"] = file_filter.report.counts()
+        return stats
+
+    def processBlobs(self, repo_path, repo, workers=None):
+        # walks the HEAD tree of repo and chunks blob contents; nothing is read from a checkout.
+        # Tracked files are not subject to .gitignore, everything else in the filter applies.
+        file_filter = FileFilter(replace(self.filter_config, use_gitignore=False))
+        store = ChunkStore(repo_path / "chunk_data")
+        items, oids, seen = [], {}, set()
+        with timed("filter", self.timings):
+            entries = list(GitHandler().iter_blobs(repo, skip_dir=file_filter.skip_directory))
+            for rel_path, blob in entries:
+                if Path(rel_path).name == ".gitattributes":
+                    file_filter.add_attributes_file(rel_path.rpartition("/")[0], blob.data.decode("utf-8", errors="replace"))
+
+            for rel_path, blob in entries:
+                language = self.detectLanguage(rel_path)
+                if language == 'unknown':
+                    file_filter.report.skip(rel_path, "unknown_language")
+                    continue
+                if not file_filter.check(rel_path, blob.size, lambda: blob.data[:HEAD_BYTES]):
+                    continue
+                seen.add(rel_path)
+                oid = str(blob.id)
+                # same blob id means same content, so the stored chunks are still valid
+                if store.blobs.get(rel_path) == oid:
+                    continue
+                oids[rel_path] = oid
+                items.append((rel_path, language, oid, blob.size))
+
+        stale = [file for file in store.files if file not in seen]
+        store.remove_files(stale)
+        store.save()
+        store.close()
+        self.logger.info(f"Reusing chunks for {len(seen) - len(items)} unchanged files, dropped {len(stale)} removed files")
+        self.writeReport(repo_path, file_filter)
+        stats = self.chunkItems(repo_path, items, workers, repo.path, oids)
+        stats["skipped"] = file_filter.report.counts()
+        return stats
+
+    def writeReport(self, repo_path, file_filter):
+        file_filter.log_report()
+        FILES_FILTERED.inc(file_filter.report.accepted, result="accepted")
+        for reason, count in file_filter.report.counts().items():
+            FILES_FILTERED.inc(count, result=reason)
         chunk_folder = repo_path / "chunk_data"
         chunk_folder.mkdir(exist_ok=True)
-        
-        for file_path in repo_path.rglob('*'):
-            if file_path.is_file() and (str(chunk_folder) not in str(file_path)):
-                self.processFile(file_path, chunk_folder)
+        (chunk_folder / "filter_report.json").write_text(json.dumps(file_filter.report.to_dict(), indent=2), encoding="utf-8")
 
-    def processFile(self, file_path, chunk_folder):
-        try:
-            language = self.detectLanguage(file_path)
-            if language == 'unknown':
-                self.logger.info(f"Skipping file with unknown language: {file_path}")
-                return
-            
-            document = FlatReader().load_data(file_path)
-            
-            code_splitter = CodeSplitter(chunk_lines=1000, language=language, max_chars=6000)
-            nodes = code_splitter.get_nodes_from_documents(document)
-            
-            # Create relative path string for naming
-            rel_path = str(file_path)
-            # Replace path separators with dashes
-            file_identifier = rel_path.replace('/', '#').replace('\\', '##')
-            
-            for i, node in enumerate(nodes, 1):
-                chunk_file_path = chunk_folder / f"{file_identifier}-{i}.json"
-                chunk_file_path.write_text(node.to_json(), encoding="utf-8")
-            
-            self.logger.info(f"Processed file: {file_path}")
-                
-        except Exception as e:
-            self.logger.error(f"Error processing file {file_path}: {str(e)}", exc_info=True)
+    def chunkItems(self, repo_path, items, workers=None, git_dir=None, blobs=None):
+        # workers > 1 chunks in a process pool, otherwise in this process
+        store = ChunkStore(repo_path / "chunk_data")
+        blobs = blobs or {}
+        start = time.perf_counter()
+        done = 0
+
+        def write(results):
+            nonlocal done
+            for rel_path, language, nodes, error in results:
+                if error is None:
+                    store.add_file(rel_path, language, nodes, blobs.get(rel_path))
+                    self.logger.info(f"Processed file: {rel_path}")
+                else:
+                    self.logger.error(f"Error processing file {rel_path}: {error}")
+                done += 1
+            if self.progress is not None:
+                self.progress("chunk", done, len(items))
+
+        with timed("chunk", self.timings):
+            if workers and workers > 1 and len(items) > 1:
+                batches = size_balanced_batches(items, workers * BATCHES_PER_WORKER)
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    futures = [executor.submit(chunk_batch, batch, git_dir) for batch in batches]
+                    for future in as_completed(futures):
+                        if self.cancelled():
+                            for pending in futures:
+                                pending.cancel()
+                            break
+                        write(future.result())
+            else:
+                for item in items:
+                    if self.cancelled():
+                        break
+                    write(chunk_batch([item[:-1]], git_dir))
+            store.save()
+            store.close()
+        STAGE_ITEMS.inc(done, stage="chunk")
+
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        total_bytes = sum(item[-1] for item in items)
+        stats = {
+            "files": len(items),
+            "bytes": total_bytes,
+            "seconds": round(elapsed, 3),
+            "files_per_sec": round(len(items) / elapsed, 2),
+            "bytes_per_sec": round(total_bytes / elapsed, 2),
+        }
+        self.logger.info(f"Chunked {repo_path}: {stats}")
+        return stats
+
+    def cancelled(self):
+        return self.cancel_event is not None and self.cancel_event.is_set()
+
+    def removeFiles(self, repo_path, rel_paths):
+        store = ChunkStore(repo_path / "chunk_data")
+        removed = store.remove_files(rel_paths)
+        store.save()
+        store.close()
+        self.logger.info(f"Removed {len(removed)} stale chunks")
+        return removed
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     base_path = Path("./cloned_repos")
     chunk_extractor = ChunkExtractor()
     chunk_extractor.processRepos(base_path)
@@ -2,109 +2,491 @@ import os
 import json
 import time
 import logging
-from collections import defaultdict
-from groq import Groq
-import instructor
+import threading
+from collections import Counter
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 from ..models.code_descriptor_model import CodeDescriptorModel, sys_prompt as code_descriptor_sys_prompt
 from ..models.code_quality_eval_model import CodeQualityModel, sys_prompt as code_quality_sys_prompt
 from ..models.code_sec_eval_model import CodeSecurityModel, sys_prompt as code_sec_sys_prompt
+from ..models.compact_model import compact_response_model, sys_prompt_suffix as compact_prompt_suffix
+from .rate_limiter import AdaptiveConcurrency, RateLimiter, estimate_tokens
+from .result_cache import ResultCache
+from .result_store import ResultStore
+from .chunk_store import Chunk, ChunkStore, chunk_file
+from .dedup import DedupIndex
+from .llm_backend import backoff_delay, get_backend, get_client, is_retryable, retry_after
+from .metrics import CHUNKS_ANALYZED, LLM_CONCURRENCY, LLM_LATENCY, LLM_REQUESTS, LLM_RETRIES, add_timing, timed
+from .score_aggregator import ScoreAggregator, SCORES_STATE_FILE, chunk_scores, chunk_weight
+from .static_metrics import static_metrics
+from .triage import TriagePolicy, CHEAP, LLM, LOCAL, local_output
 load_dotenv(dotenv_path=".env")
 logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
 
 GROQ_MODEL = "gemma2-9b-it"#"llama-3.1-70b-versatile"
-TIME_DELAY = 1
+GROQ_CHEAP_MODEL = "llama-3.1-8b-instant"
+GROQ_RPM = 30
+GROQ_TPM = 15000
+MAX_CONCURRENCY = 4
+CONCURRENCY_HEADROOM = 4
+COMPLETION_TOKENS = 1024
+COMPACT_COMPLETION_TOKENS = 256
+MAX_ATTEMPTS = 4
+RETRY_ROUNDS = 3
+
+ANALYSIS_MODES = {
+    "code_descriptor": (code_descriptor_sys_prompt, CodeDescriptorModel),
+    "code_quality": (code_quality_sys_prompt, CodeQualityModel),
+    "code_security": (code_sec_sys_prompt, CodeSecurityModel),
+}
+MAPPING_FILE = "file_output_mapping.json"
+DEDUP_REPORT_FILE = "dedup_report.json"
+RETRY_QUEUE_FILE = "retry_queue.json"
+REMARKS_DIR = "remarks"
+
+class CallBudgetExceeded(RuntimeError):
+    # raised instead of sending a request once an analyser's call cap is spent
+    pass
+
+
+def output_filename(chunk_id: str) -> str:
+    # reversible and collision free, unlike swapping '/' for '#'
+    return f"{quote(chunk_id, safe='')}.json"
+
+
+def load_mapping(repo_path, mapping_file=MAPPING_FILE):
+    mapping_path = os.path.join(repo_path, mapping_file)
+    if not os.path.exists(mapping_path):
+        return {}
+    with open(mapping_path, 'r') as f:
+        return json.load(f)
+
+
+def save_mapping(repo_path, mapping, mapping_file=MAPPING_FILE):
+    with open(os.path.join(repo_path, mapping_file), "w") as f:
+        json.dump(mapping, f, indent=2)
 
 class CodeAnalyser:
-    def __init__(self, analysis_mode: str):
+    def __init__(self, analysis_mode: str, max_workers: int = 1, rpm: int = GROQ_RPM, tpm: int = GROQ_TPM, cache: ResultCache = None, progress=None, cancel_event=None, on_result=None,
+                 rate_limiter: RateLimiter = None, output_dir: str = "output_data", mapping_file: str = MAPPING_FILE, dedup: DedupIndex = None,
+                 backend=None, timings=None, concurrency: AdaptiveConcurrency = None, triage: TriagePolicy = None,
+                 compact: bool = False, result_store: ResultStore = None):
+        # progress(stage, done, total) is called as chunks complete; setting cancel_event stops new calls;
+        # on_result(chunk, output json or None) is called from the worker thread as each chunk finishes
         self.logger = logging.getLogger(__name__)
-        self.sys_prompt = None
-        self.response_model = None
-        if analysis_mode == "code_descriptor":
-            self.sys_prompt = code_descriptor_sys_prompt
-            self.response_model = CodeDescriptorModel
-        elif analysis_mode == "code_quality":
-            self.sys_prompt = code_quality_sys_prompt
-            self.response_model = CodeQualityModel
-        elif analysis_mode == "code_security":
-            self.sys_prompt = code_sec_sys_prompt
-            self.response_model = CodeSecurityModel
+        self.progress = progress
+        self.on_result = on_result
+        self.cancel_event = cancel_event
+        self.analysis_mode = analysis_mode
+        self.cache = cache
+        self.max_workers = max_workers
+        self.rate_limiter = rate_limiter or RateLimiter(rpm, tpm)
+        # starts at max_workers and may grow past it while the provider keeps accepting calls
+        self.concurrency = concurrency or AdaptiveConcurrency(max_workers, maximum=max_workers * CONCURRENCY_HEADROOM)
+        self.output_dir = output_dir
+        self.mapping_file = mapping_file
+        self.dedup = dedup
+        self.result_store = result_store
+        self.backend = backend or get_backend()
+        self.timings = timings
+        # None sends every chunk to GROQ_MODEL, as before triage existed
+        self.triage = triage
+        # {chunk id: latest decision}, so chunks routed again in a retry round are counted once
+        self.triage_decisions = {}
+        self.triage_lock = threading.Lock()
+        self.dedup_report = None
+        self.scores = ScoreAggregator()
+        self.sys_prompt = self.full_prompt = None
+        self.response_model = self.full_model = None
+        self.completion_tokens = COMPLETION_TOKENS
+        self.compact = False
+        if analysis_mode in ANALYSIS_MODES:
+            self.sys_prompt, self.response_model = ANALYSIS_MODES[analysis_mode]
+            # compact runs ask for bare scores only; the full review stays available through remarks()
+            self.full_prompt, self.full_model = self.sys_prompt, self.response_model
+            if compact and self.response_model is not CodeDescriptorModel:
+                self.compact = True
+                self.sys_prompt = self.sys_prompt + compact_prompt_suffix
+                self.response_model = compact_response_model(self.response_model)
+                self.completion_tokens = COMPACT_COMPLETION_TOKENS
         else:
             print("choose one of the following analysis modes: code_descriptor, code_quality, code_security")
 
-    def get_code(self, file_path: str):
-        with open(file_path, 'r') as f:
-            return f.read()
-
-    def get_output(self, file_path: str):
-        client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-        client = instructor.from_groq(client, mode=instructor.Mode.TOOLS)
-
-        output = client.chat.completions.create(
-            model=GROQ_MODEL,
-            messages=[
-                {"role": "system", "content": self.sys_prompt},
-                {"role": "user", "content": self.get_code(file_path)},
-            ],
-            response_model=self.response_model,
-        )
-        return output
-
-    def process_repo(self, repo_path):
+    @property
+    def client(self):
+        return get_client()
+
+    def get_output(self, code: str, sys_prompt: str = None, response_model=None, completion_tokens: int = None, model: str = GROQ_MODEL):
+        # retries 429s, 5xx and connection errors with jittered backoff, honouring retry-after
+        sys_prompt = sys_prompt or self.sys_prompt
+        completion_tokens = completion_tokens or self.completion_tokens
+        tokens = estimate_tokens(sys_prompt + code) + completion_tokens
+        for attempt in range(MAX_ATTEMPTS):
+            # the slot comes first so that a shared pool decides whose turn it is before the budget is spent
+            self.concurrency.acquire()
+            self.rate_limiter.acquire(tokens)
+            try:
+                output = self.call_backend(code, sys_prompt, response_model, model)
+            except Exception as e:
+                rate_limited = getattr(e, "status_code", None) == 429
+                delay = retry_after(e) if rate_limited else None
+                self.concurrency.release("rate_limited" if rate_limited else "error", delay or backoff_delay(attempt))
+                LLM_CONCURRENCY.set(self.concurrency.limit)
+                if not is_retryable(e) or attempt == MAX_ATTEMPTS - 1 or self.cancelled():
+                    raise
+                LLM_RETRIES.inc(model=model)
+                self.logger.info(f"LLM call failed ({str(e)}), retry {attempt + 1} of {MAX_ATTEMPTS - 1}")
+                if not rate_limited:
+                    time.sleep(backoff_delay(attempt))
+                continue
+            self.concurrency.release("ok")
+            LLM_CONCURRENCY.set(self.concurrency.limit)
+            return output
+
+    def call_backend(self, code: str, sys_prompt: str, response_model=None, model: str = GROQ_MODEL):
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            output = self.backend.complete(model, sys_prompt, code, response_model or self.response_model)
+            outcome = "ok"
+            return output
+        except Exception as e:
+            if getattr(e, "status_code", None) == 429:
+                outcome = "rate_limited"
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            LLM_REQUESTS.inc(model=model, outcome=outcome)
+            LLM_LATENCY.observe(elapsed, model=model)
+            add_timing(self.timings, "llm_call", elapsed)
+
+    def process_repo(self, repo_path, files=None):
+        # files: repo-relative paths to (re)analyze, None analyzes every chunk
         mapping = {}
-        output_folder = os.path.join(repo_path, "output_data")
-        os.makedirs(output_folder, exist_ok=True)
-        chunk_folder_path = os.path.join(repo_path, "chunk_data")
+        self.scores = ScoreAggregator()
+        self.dedup_report = None
+        self.triage_decisions = {}
+        if files is not None:
+            mapping = {k: v for k, v in load_mapping(repo_path, self.mapping_file).items() if os.path.exists(v)}
+            self.scores = self.load_scores(repo_path, mapping)
+            self.scores.retain(mapping)
+        chunks = self.load_chunks(repo_path, files)
+        # chunks that failed in an earlier run go first in line, unless they are already being redone
+        queued = self.load_retry_queue(repo_path)
+        chunk_ids = {chunk.id for chunk in chunks}
+        requeued = self.load_chunk_ids(repo_path, [chunk_id for chunk_id in queued if chunk_id not in chunk_ids])
+        # ids whose chunk is gone, because the file was deleted or re-chunked into fewer pieces, leave the queue
+        queued = [chunk_id for chunk_id in queued if chunk_id in chunk_ids] + [chunk.id for chunk in requeued]
+        chunks = requeued + chunks
+
+        with timed("analyze", self.timings):
+            failed = []
+            for done, (chunk, output_file_path) in enumerate(self.iter_repo(repo_path, chunks), 1):
+                if output_file_path is not None:
+                    mapping[chunk.id] = output_file_path
+                else:
+                    failed.append(chunk)
+                if self.progress is not None:
+                    self.progress("analyze", done, len(chunks))
 
-        for file in os.listdir(chunk_folder_path):
-            file_path = os.path.join(chunk_folder_path, file)
-            if os.path.isfile(file_path):
-                self.logger.info(f"Processing chunk: {file_path}")
-                self.process_chunk(file_path, output_folder, mapping)
-                time.sleep(TIME_DELAY)
+            for retry_round in range(RETRY_ROUNDS):
+                if not failed or self.cancelled():
+                    break
+                time.sleep(backoff_delay(retry_round + 1))
+                self.logger.info(f"Retrying {len(failed)} failed chunks, round {retry_round + 1} of {RETRY_ROUNDS}")
+                retrying, failed = failed, []
+                for done, (chunk, output_file_path) in enumerate(self.iter_repo(repo_path, retrying), 1):
+                    if output_file_path is not None:
+                        mapping[chunk.id] = output_file_path
+                    else:
+                        failed.append(chunk)
+                    if self.progress is not None:
+                        self.progress("retry", done, len(retrying))
 
-        with open(os.path.join(repo_path, "file_output_mapping.json"), "w") as f:
-            json.dump(mapping, f, indent=2)
+        # a cancelled run did not really try its remaining chunks, so only successes leave the queue
+        remaining = set(queued) | ({chunk.id for chunk in failed} if not self.cancelled() else set())
+        self.save_retry_queue(repo_path, sorted(chunk_id for chunk_id in remaining if chunk_id not in mapping))
 
+        if self.cache is not None:
+            self.logger.info(f"Result cache stats: {self.cache.stats()}")
+
+        save_mapping(repo_path, mapping, self.mapping_file)
+        self.index_results(repo_path, mapping)
+        if self.cancelled():
+            self.logger.info(f"Analysis of {repo_path} cancelled")
+            return
         self.final_scores(repo_path)
 
-    def process_chunk(self, file_path, output_folder, mapping):
-        try:
-            output = self.get_output(file_path).model_dump_json(indent=2)
-            output_file_path = os.path.join(output_folder, f"{os.path.splitext(os.path.basename(file_path))[0]}.json")
-            
-            with open(output_file_path, "w", encoding="utf-8") as f:
-                f.write(output)
-            
-            mapping[file_path] = output_file_path
-        except Exception as e:
-            self.logger.error(f"Error processing file {file_path}: {str(e)}")
+    def index_results(self, repo_path, mapping):
+        if self.result_store is not None:
+            self.result_store.ingest(repo_path, self.analysis_mode, mapping)
 
-    def final_scores(self, repo_path):
-        if type(self.response_model) == CodeDescriptorModel:
+    def load_chunks(self, repo_path, files=None):
+        store = ChunkStore(os.path.join(repo_path, "chunk_data"))
+        if files is None:
+            chunks = list(store.iter_chunks())
+        else:
+            chunks = [chunk for file in files for chunk in store.iter_file(file)]
+        store.close()
+        return chunks
+
+    def load_chunk_ids(self, repo_path, chunk_ids):
+        if not chunk_ids:
+            return []
+        store = ChunkStore(os.path.join(repo_path, "chunk_data"))
+        # unknown ids are skipped, ChunkStore.get raises on them
+        chunks = [store.get(chunk_id) for chunk_id in chunk_ids if chunk_id in store.chunks]
+        store.close()
+        return chunks
+
+    def retry_queue_path(self, repo_path):
+        return os.path.join(repo_path, self.output_dir, RETRY_QUEUE_FILE)
+
+    def load_retry_queue(self, repo_path):
+        path = self.retry_queue_path(repo_path)
+        if not os.path.exists(path):
+            return []
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def save_retry_queue(self, repo_path, chunk_ids):
+        path = self.retry_queue_path(repo_path)
+        if chunk_ids:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                json.dump(chunk_ids, f, indent=2)
+            self.logger.warning(f"{len(chunk_ids)} chunks still failing, kept in {path} for the next run")
+        elif os.path.exists(path):
+            os.remove(path)
+
+    def load_scores(self, repo_path, mapping):
+        state_path = os.path.join(repo_path, self.output_dir, SCORES_STATE_FILE)
+        if os.path.exists(state_path):
+            return ScoreAggregator.load(state_path)
+        # no saved state from an earlier run, rebuild it once from the outputs that are kept
+        scores = ScoreAggregator()
+        store = ChunkStore(os.path.join(repo_path, "chunk_data"))
+        for chunk_id, output_file_path in mapping.items():
+            if chunk_id not in store.chunks:
+                continue
+            chunk = store.get(chunk_id)
+            with open(output_file_path, "r", encoding="utf-8") as f:
+                scores.add(chunk_id, chunk.file, chunk_weight(chunk.text), chunk_scores(json.load(f)))
+        store.close()
+        return scores
+
+    def iter_repo(self, repo_path, chunks):
+        # yields (chunk, output file path or None) as soon as each chunk finishes
+        output_folder = os.path.join(repo_path, self.output_dir)
+        os.makedirs(output_folder, exist_ok=True)
+        if self.dedup is None:
+            yield from self.iter_chunks(chunks, output_folder)
             return
-        directory = os.path.join(repo_path, "output_data")
-        score_aggregation = defaultdict(int)
-        files = 0
 
-        for filename in os.listdir(directory):
-            if filename.endswith('.json'):
-                with open(os.path.join(directory, filename), 'r') as file:
-                    data = json.load(file)
+        representatives, members = self.dedup.cluster(repo_path, chunks)
+        variant = self.dedup_variant()
+        analysed = {chunk.id: ref for ref, chunk in representatives}
+        # retry rounds add to the report of the run they belong to
+        report = self.dedup_report or {"chunks": len(chunks), "analysed": 0, "exact_duplicates": 0, "near_duplicates": 0, "calls_saved": 0, "members": {}}
+        report["analysed"] += len(representatives)
+        pending = {ref: [] for ref, _ in representatives}
+        for ref, group in members.items():
+            if ref in pending:
+                pending[ref] = group
+                continue
+            output = self.dedup.output(ref, variant)
+            if output is not None:
+                # the representative was analysed in an earlier run or another repo
+                for chunk, similarity in group:
+                    yield chunk, self.fan_out(chunk, ref, similarity, output, output_folder, report)
+                continue
+            # no usable output for the representative in this mode, analyse the first member in its place
+            chunk, _ = group[0]
+            analysed[chunk.id] = ref
+            report["analysed"] += 1
+            pending[ref] = group[1:]
+
+        to_analyse = [chunk for chunk in chunks if chunk.id in analysed]
+        for chunk, output_file_path in self.iter_chunks(to_analyse, output_folder):
+            yield chunk, output_file_path
+            ref = analysed[chunk.id]
+            output = None
+            if output_file_path is not None:
+                with open(output_file_path, "r", encoding="utf-8") as f:
+                    output = f.read()
+                self.dedup.record(ref, variant, output)
+            for member, similarity in pending.get(ref, []):
+                if output is None:
+                    yield member, None
+                else:
+                    yield member, self.fan_out(member, f"{repo_path}:{chunk.id}", similarity, output, output_folder, report)
+
+        self.dedup_report = report
+        self.logger.info(f"Dedup saved {report['calls_saved']} of {len(chunks)} calls "
+                         f"({report['exact_duplicates']} exact, {report['near_duplicates']} near duplicates)")
+        with open(os.path.join(output_folder, DEDUP_REPORT_FILE), "w") as f:
+            json.dump(report, f, indent=2)
+
+    def dedup_variant(self):
+        # results are only shared between duplicates analysed with the same mode, model and prompt; with triage
+        # on, the model is picked per chunk and a member takes whatever its representative was routed to
+        return ResultCache.make_key("", self.analysis_mode, GROQ_MODEL if self.triage is None else "triage", self.sys_prompt)
+
+    def fan_out(self, chunk: Chunk, source: str, similarity: float, output: str, output_folder, report):
+        # copies the representative's result to a cluster member and records where it came from
+        data = json.loads(output)
+        data["duplicate_of"] = {"chunk": source, "similarity": round(similarity, 3)}
+        report["calls_saved"] += 1
+        report["exact_duplicates" if similarity == 1.0 else "near_duplicates"] += 1
+        report["members"][chunk.id] = data["duplicate_of"]
+        return self.store_output(chunk, json.dumps(data, indent=2), output_folder, fresh=False, source="dedup")
+
+    def iter_chunks(self, chunks, output_folder):
+        executor = ThreadPoolExecutor(max_workers=self.concurrency.maximum)
+        futures = {executor.submit(self.process_chunk, chunk, output_folder): chunk for chunk in chunks}
+        try:
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            # a consumer that stops early should not keep paying for the remaining calls
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+    def cancelled(self):
+        return self.cancel_event is not None and self.cancel_event.is_set()
+
+    def remove_outputs(self, repo_path, files):
+        files = set(files)
+        mapping = load_mapping(repo_path, self.mapping_file)
+        for chunk_id in [chunk_id for chunk_id in mapping if chunk_file(chunk_id) in files]:
+            output_file_path = mapping.pop(chunk_id)
+            if os.path.exists(output_file_path):
+                os.remove(output_file_path)
+        save_mapping(repo_path, mapping, self.mapping_file)
 
-                for key, value in data.items():
-                    if isinstance(value, dict) and 'score' in value:
-                        score_aggregation[key] += value['score']
-                files += 1
+    def cache_key(self, chunk: Chunk, model: str = GROQ_MODEL):
+        return ResultCache.make_key(chunk.text, self.analysis_mode, model, self.sys_prompt)
 
-        for category in score_aggregation:
-            score_aggregation[category] = round(score_aggregation[category] / files)
+    def cached_output(self, chunk: Chunk, model: str = GROQ_MODEL):
+        if self.cache is None:
+            return None
+        return self.cache.get(self.cache_key(chunk, model))
 
-        output_data = {"scores_by_category": dict(score_aggregation)}
-        output_file = os.path.join(repo_path, "output_data/scores_summary.json")
+    @property
+    def triage_report(self):
+        with self.triage_lock:
+            return dict(Counter(self.triage_decisions.values()))
 
-        with open(output_file, 'w') as file:
-            json.dump(output_data, file, indent=2)
+    def route(self, chunk: Chunk):
+        # (LOCAL, CHEAP or LLM, static metrics or None)
+        if self.triage is None:
+            return LLM, None
+        metrics = static_metrics(chunk)
+        decision = self.triage.decide(chunk.language, metrics, self.analysis_mode)
+        with self.triage_lock:
+            self.triage_decisions[chunk.id] = decision
+        return decision, metrics
+
+    def annotate(self, output: str, decision: str, metrics: dict) -> str:
+        if metrics is None:
+            return output
+        data = json.loads(output)
+        data["static_metrics"] = metrics
+        data["triage"] = decision
+        return json.dumps(data, indent=2)
+
+    def store_output(self, chunk: Chunk, output: str, output_folder, fresh: bool = True, source: str = None, model: str = GROQ_MODEL):
+        # fresh outputs came from the model and go into the cache as well; source labels the metric
+        CHUNKS_ANALYZED.inc(mode=self.analysis_mode, source=source or ("llm" if fresh else "cache"))
+        if fresh and self.cache is not None:
+            self.cache.put(self.cache_key(chunk, model), output)
+        output_file_path = os.path.join(output_folder, output_filename(chunk.id))
+        with open(output_file_path, "w", encoding="utf-8") as f:
+            f.write(output)
+        if self.response_model is not CodeDescriptorModel:
+            self.scores.add(chunk.id, chunk.file, chunk_weight(chunk.text), chunk_scores(json.loads(output)))
+        if self.on_result is not None:
+            self.on_result(chunk, output)
+        return output_file_path
+
+    def process_chunk(self, chunk: Chunk, output_folder):
+        if self.cancelled():
+            return None
+        self.logger.info(f"Processing chunk: {chunk.id}")
+        try:
+            decision, metrics = self.route(chunk)
+            if decision == LOCAL:
+                output = self.annotate(json.dumps(local_output(metrics, self.response_model)), decision, metrics)
+                return self.store_output(chunk, output, output_folder, fresh=False, source="local")
+            model = GROQ_CHEAP_MODEL if decision == CHEAP else GROQ_MODEL
+            output = self.cached_output(chunk, model)
+            fresh = output is None
+            if fresh:
+                output = self.get_output(chunk.payload, model=model).model_dump_json(indent=2)
+            # cached results from before triage was on get their metrics too
+            output = self.annotate(output, decision, metrics)
+            return self.store_output(chunk, output, output_folder, fresh, source="cheap" if fresh and decision == CHEAP else None, model=model)
+        except Exception as e:
+            self.logger.error(f"Error processing chunk {chunk.id}: {str(e)}")
+            CHUNKS_ANALYZED.inc(mode=self.analysis_mode, source="error")
+            if self.on_result is not None:
+                self.on_result(chunk, None)
+
+    def remarks_path(self, repo_path, chunk: Chunk, key: str):
+        # one folder per chunk, one file per chunk text, so a review of code that has since changed is never served
+        return os.path.join(repo_path, self.output_dir, REMARKS_DIR, self.analysis_mode, quote(chunk.id, safe=""), f"{key}.json")
+
+    def remarks(self, repo_path, chunk_ids):
+        # full reviews, remarks included, for the few chunks someone opens after a compact run.
+        # {chunk_id: review or None if it failed}; unknown or stale ids are filtered out before the lookup and
+        # left out, repeated ones are fetched once
+        chunks = self.load_chunk_ids(repo_path, list(dict.fromkeys(chunk_ids)))
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.concurrency.maximum) as executor:
+            futures = {executor.submit(self.full_review, repo_path, chunk): chunk for chunk in chunks}
+            for future in as_completed(futures):
+                results[futures[future].id] = future.result()
+        return results
+
+    def full_review(self, repo_path, chunk: Chunk):
+        # kept next to the repo's outputs and in the result cache under the full prompt, which a full run shares
+        key = ResultCache.make_key(chunk.text, self.analysis_mode, GROQ_MODEL, self.full_prompt)
+        path = self.remarks_path(repo_path, chunk, key)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        output = self.cache.get(key) if self.cache is not None else None
+        if output is None:
+            try:
+                output = self.get_output(chunk.payload, self.full_prompt, self.full_model, COMPLETION_TOKENS).model_dump_json(indent=2)
+            except Exception as e:
+                self.logger.error(f"Error fetching remarks for chunk {chunk.id}: {str(e)}")
+                return None
+            if self.cache is not None:
+                self.cache.put(key, output)
+        folder = os.path.dirname(path)
+        os.makedirs(folder, exist_ok=True)
+        # reviews of earlier versions of the chunk go; a concurrent request may have removed them already
+        for name in os.listdir(folder):
+            try:
+                os.remove(os.path.join(folder, name))
+            except FileNotFoundError:
+                pass
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(output)
+        return json.loads(output)
+
+    def final_scores(self, repo_path):
+        if self.response_model is CodeDescriptorModel:
+            return
+        directory = os.path.join(repo_path, self.output_dir)
+        output_file = os.path.join(directory, "scores_summary.json")
+        with timed("aggregate", self.timings):
+            with open(output_file, 'w') as file:
+                json.dump(self.scores.to_summary(), file, indent=2)
+            self.scores.save(os.path.join(directory, SCORES_STATE_FILE))
 
         self.logger.info(f"Scores summary saved to: {output_file}")
 
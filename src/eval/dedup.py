@@ -0,0 +1,130 @@
+import re
+import zlib
+import logging
+import threading
+from collections import defaultdict
+import numpy as np
+from .result_cache import sha256
+
+SHINGLE_SIZE = 5
+MIN_TOKENS = 20
+NUM_PERM = 64
+BANDS = 16
+SIMILARITY_THRESHOLD = 0.85
+MAX_ENTRIES = 200000
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+_rng = np.random.RandomState(1)
+PERM_A = _rng.randint(1, 1 << 32, size=NUM_PERM, dtype=np.uint64)
+PERM_B = _rng.randint(0, 1 << 32, size=NUM_PERM, dtype=np.uint64)
+
+
+def fingerprint(text: str):
+    # (hash of the whitespace-normalized token stream, MinHash signature over token shingles or None for tiny chunks)
+    tokens = TOKEN_PATTERN.findall(text)
+    digest = sha256(" ".join(tokens))
+    if len(tokens) < MIN_TOKENS:
+        return digest, None
+    shingles = {zlib.crc32(" ".join(tokens[i:i + SHINGLE_SIZE]).encode()) for i in range(len(tokens) - SHINGLE_SIZE + 1)}
+    hashes = np.fromiter(shingles, dtype=np.uint64, count=len(shingles))
+    signature = ((np.outer(hashes, PERM_A) + PERM_B) % MERSENNE_PRIME & MAX_HASH).min(axis=0)
+    return digest, signature
+
+
+def band_keys(signature):
+    rows = NUM_PERM // BANDS
+    return [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(BANDS)]
+
+
+class DedupIndex:
+    # representatives seen so far across every repo analysed by this process, refs are "<repo path>:<chunk id>"
+    def __init__(self, threshold: float = SIMILARITY_THRESHOLD, max_entries: int = MAX_ENTRIES):
+        self.logger = logging.getLogger(__name__)
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.digests = {}
+        self.exact = {}
+        self.signatures = {}
+        self.buckets = defaultdict(list)
+        self.outputs = {}
+
+    def find(self, digest, signature):
+        ref = self.exact.get(digest)
+        if ref is not None:
+            return ref, 1.0
+        if signature is None:
+            return None, 0.0
+        best, best_similarity = None, 0.0
+        for key in band_keys(signature):
+            for ref in self.buckets.get(key, ()):
+                if ref not in self.signatures:
+                    continue
+                similarity = float(np.mean(self.signatures[ref] == signature))
+                if similarity > best_similarity:
+                    best, best_similarity = ref, similarity
+        if best_similarity < self.threshold:
+            return None, 0.0
+        return best, best_similarity
+
+    def add(self, ref, digest, signature):
+        if ref in self.digests:
+            return
+        if len(self.digests) >= self.max_entries:
+            self.logger.info(f"Dedup index reached {self.max_entries} entries, starting over")
+            self.clear()
+        self.digests[ref] = digest
+        self.exact[digest] = ref
+        if signature is not None:
+            self.signatures[ref] = signature
+            for key in band_keys(signature):
+                self.buckets[key].append(ref)
+
+    def forget(self, ref):
+        # bucket lists are left alone, find() skips refs without a signature
+        digest = self.digests.pop(ref, None)
+        if self.exact.get(digest) == ref:
+            del self.exact[digest]
+        self.signatures.pop(ref, None)
+        for key in [key for key in self.outputs if key[0] == ref]:
+            del self.outputs[key]
+
+    def clear(self):
+        self.digests.clear()
+        self.exact.clear()
+        self.signatures.clear()
+        self.buckets.clear()
+        self.outputs.clear()
+
+    def cluster(self, scope: str, chunks):
+        # returns (representatives, members): representatives is [(ref, chunk)] for chunks that start a new
+        # cluster, members maps a ref (possibly from an earlier run or repo) to [(chunk, similarity)]
+        representatives, members = [], defaultdict(list)
+        fingerprints = [fingerprint(chunk.text) for chunk in chunks]
+        with self.lock:
+            for chunk, (digest, signature) in zip(chunks, fingerprints):
+                ref = f"{scope}:{chunk.id}"
+                if ref in self.digests and self.digests[ref] != digest:
+                    # the chunk changed since it was indexed, its old output no longer describes it
+                    self.forget(ref)
+                match, similarity = self.find(digest, signature)
+                if match is None or match == ref:
+                    self.add(ref, digest, signature)
+                    representatives.append((ref, chunk))
+                else:
+                    members[match].append((chunk, similarity))
+        return representatives, members
+
+    def record(self, ref, variant, output: str):
+        # the output text itself is kept, output files get rewritten by later runs in other modes;
+        # variant tells apart results made with a different mode, model or prompt
+        with self.lock:
+            if ref in self.digests:
+                self.outputs[(ref, variant)] = zlib.compress(output.encode("utf-8"))
+
+    def output(self, ref, variant):
+        with self.lock:
+            data = self.outputs.get((ref, variant))
+        return zlib.decompress(data).decode("utf-8") if data is not None else None
@@ -1,57 +1,326 @@
-from fastapi import FastAPI, HTTPException
-from typing import Dict
-from src.models.endpoint_models import AnalysisRequest, AnalysisResponse, Init
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from typing import Dict, List
+from src.models.endpoint_models import AnalysisRequest, AnalysisResponse, BatchRequest, Init, MultiAnalysisRequest, RemarksRequest
+from src.eval.code_analyser import ANALYSIS_MODES, CodeAnalyser, MAPPING_FILE, MAX_CONCURRENCY, load_mapping
+from src.eval.pipeline import init_repository, analyze_repository, analyze_repository_modes
+from src.eval.multi_repo import MultiRepoEvaluator, SCHEDULING
+from src.eval.result_cache import ResultCache
+from src.eval.result_store import DEFAULT_LIMIT, QueryError, ResultStore
+from src.eval.dedup import DedupIndex
+from src.eval.repo_state import RepoState
+from src.eval.score_aggregator import rank_repositories
+from src.eval.triage import TriagePolicy
 from src.eval.git_handler import GitHandler
-from src.eval.chunker import ChunkExtractor
-from src.eval.code_analyser import CodeAnalyser
+from src.eval.mirror_cache import MirrorCache
+from src.eval.jobs import JobManager, SUCCEEDED, FINISHED
+from src.eval.metrics import REGISTRY, JOBS_BY_STATUS
+from collections import defaultdict
 import os
 import json
+import time
+import uuid
+import queue
 
 
 app = FastAPI()
 BASE_PATH = "./cloned_repos"
-REPO_PATH = ''
-
-
-def read_output_data(repo_path):
-    output_data_path = os.path.join(repo_path, "output_data")
-    result = {}
-    
-    for root, _, files in os.walk(output_data_path):
-        for file in files:
-            if file.endswith(".json"):
-                file_path = os.path.join(root, file)
-                with open(file_path, 'r') as f:
-                    chunk_data = json.load(f)
-                
-                # Extract the original file path from the JSON file name
-                relative_path = file.replace('#', '/').rsplit('-', 1)[0]
-                if relative_path not in result:
-                    result[relative_path] = []
-                result[relative_path].append(chunk_data)
-    
-    return result
+RESULT_CACHE = ResultCache()
+RESULT_STORE = ResultStore()
+DEDUP_INDEX = DedupIndex()
+MIRRORS = MirrorCache(BASE_PATH)
+JOBS = JobManager()
+STREAM_END = object()
+STREAM_POLL_SECONDS = 1.0
+MAX_REMARKS_CHUNKS = 20
+
+
+def read_scores_summary(repo_path, output_dir="output_data"):
+    summary_path = os.path.join(repo_path, output_dir, "scores_summary.json")
+    if not os.path.exists(summary_path):
+        return None
+    with open(summary_path, 'r') as f:
+        return json.load(f)
+
+
+def read_mode_summary(repo_path, analysis_type):
+    # /analyze/multi keeps each mode in its own folder, /analyze writes the last analysed mode to output_data
+    summary = read_scores_summary(repo_path, os.path.join("output_data", analysis_type))
+    if summary is None and RepoState(repo_path).analyzed_mode == analysis_type:
+        summary = read_scores_summary(repo_path)
+    return summary
+
+
+def index_existing_results(repo_path, analysis_type):
+    # results written before the store existed are indexed on first query, from the mapping read_mode_summary would use
+    if RESULT_STORE.count(repo_path, analysis_type):
+        return
+    mapping = load_mapping(repo_path, os.path.join("output_data", analysis_type, MAPPING_FILE))
+    if not mapping and RepoState(repo_path).analyzed_mode == analysis_type:
+        mapping = load_mapping(repo_path)
+    if mapping:
+        RESULT_STORE.ingest(repo_path, analysis_type, mapping)
+
+
+def check_analysis_types(*analysis_types):
+    # an unknown mode would otherwise queue a job whose every chunk fails
+    unknown = [analysis_type for analysis_type in analysis_types if analysis_type not in ANALYSIS_MODES]
+    if unknown or not analysis_types:
+        raise HTTPException(status_code=400, detail=f"Unknown analysis type, choose from: {', '.join(ANALYSIS_MODES)}")
+
+
+def get_job(job_id):
+    job = JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
 
 
 @app.post("/init")
 def init(data: Init) -> Dict[str, str]:
-    git_handler = GitHandler()
-    git_handler = GitHandler(BASE_PATH)
-    git_handler.clone_repository(data.url)
-    repo_name = os.path.splitext(data.url.split('/')[-1])[0]
-    global REPO_PATH
-    REPO_PATH = os.path.join(BASE_PATH, repo_name)
-    chunk_extractor = ChunkExtractor()
-    chunk_extractor.processRepos(BASE_PATH)
-    return {"message": "Repository initialized."}
+    repo_path = GitHandler(BASE_PATH).repo_path(data.url)
+
+    def run(job):
+        init_repository(data.url, BASE_PATH, checkout=data.checkout, progress=job.update_progress, cancel_event=job.cancel_event, timings=job.timings,
+                        mirrors=MIRRORS)
+        return {"repo": repo_path}
+
+    job = JOBS.submit("init", repo_path, run, url=data.url)
+    return {"message": "Repository initialization queued.", "job_id": job.id}
 
 @app.post("/analyze/")
 def analyze_code(data: AnalysisRequest):
-    code_analyser = CodeAnalyser(data.analysis_type)
-    code_analyser.process_repo(REPO_PATH)
-    output_data = read_output_data(REPO_PATH)
-    
-    return {"message": "Repository analyzed.", "output_data": output_data}
+    check_analysis_types(data.analysis_type)
+    repo_path = GitHandler(BASE_PATH).repo_path(data.url)
+
+    def run(job):
+        # the working copy must not be evicted while the analysis writes to it
+        with MIRRORS.using(data.url):
+            code_analyser = analyze_repository(
+                repo_path, data.analysis_type, batch_tokens=data.batch_tokens, max_workers=MAX_CONCURRENCY, cache=RESULT_CACHE,
+                result_store=RESULT_STORE, dedup=DEDUP_INDEX if data.dedup else None, progress=job.update_progress,
+                cancel_event=job.cancel_event, timings=job.timings,
+                triage=TriagePolicy() if data.triage else None, compact=data.compact, max_calls=data.max_calls,
+                ci_width=data.ci_width, sample_calls=data.sample_calls,
+            )
+        return {"repo": repo_path, "scores": read_scores_summary(repo_path), "dedup": code_analyser.dedup_report, "triage": code_analyser.triage_report,
+                "hierarchy": getattr(code_analyser, "hierarchy", None), "estimate": getattr(code_analyser, "estimate", None)}
+
+    job = JOBS.submit("analyze", repo_path, run, url=data.url, analysis_type=data.analysis_type, batch_tokens=data.batch_tokens, dedup=data.dedup, triage=data.triage,
+                      compact=data.compact, max_calls=data.max_calls, ci_width=data.ci_width, sample_calls=data.sample_calls)
+    return {"message": "Repository analysis queued.", "job_id": job.id}
+
+@app.post("/analyze/multi")
+def analyze_code_multi(data: MultiAnalysisRequest):
+    check_analysis_types(*data.analysis_types)
+    repo_path = GitHandler(BASE_PATH).repo_path(data.url)
+
+    def run(job):
+        with MIRRORS.using(data.url):
+            analyze_repository_modes(
+                repo_path, data.analysis_types, combined=data.combined, compact=data.compact, max_workers=MAX_CONCURRENCY, cache=RESULT_CACHE,
+                result_store=RESULT_STORE, progress=job.update_progress, cancel_event=job.cancel_event, timings=job.timings,
+            )
+        scores = {mode: read_scores_summary(repo_path, os.path.join("output_data", mode)) for mode in data.analysis_types}
+        return {"repo": repo_path, "scores": scores}
+
+    job = JOBS.submit("analyze_multi", repo_path, run, url=data.url, analysis_types=data.analysis_types, combined=data.combined,
+                      compact=data.compact)
+    return {"message": "Repository analysis queued.", "job_id": job.id}
+
+@app.post("/batch")
+def evaluate_batch(data: BatchRequest):
+    check_analysis_types(data.analysis_type)
+    if data.scheduling not in SCHEDULING:
+        raise HTTPException(status_code=400, detail=f"scheduling must be one of: {', '.join(SCHEDULING)}")
+
+    def run(job):
+        def on_progress(repos):
+            finished = sum(repo["status"] in ("succeeded", "failed", "cancelled") for repo in repos.values())
+            job.progress = {"stage": "batch", "done": finished, "total": len(repos), "repos": repos}
+
+        evaluator = MultiRepoEvaluator(
+            data.urls, data.analysis_type, BASE_PATH, scheduling=data.scheduling, checkout=data.checkout,
+            max_workers=MAX_CONCURRENCY, cache=RESULT_CACHE, result_store=RESULT_STORE, dedup=DEDUP_INDEX if data.dedup else None,
+            triage=TriagePolicy() if data.triage else None, compact=data.compact, max_calls=data.max_calls,
+            ci_width=data.ci_width, sample_calls=data.sample_calls,
+            cancel_event=job.cancel_event, on_progress=on_progress, timings=job.timings, mirrors=MIRRORS, repo_lock=JOBS.repo_lock,
+        )
+        return evaluator.run()
+
+    # a batch gets its own queue, the repos inside it are scheduled by the evaluator and take the same per-repo
+    # locks as /init and /analyze jobs
+    job = JOBS.submit("batch", f"batch:{uuid.uuid4().hex}", run, urls=data.urls, analysis_type=data.analysis_type, scheduling=data.scheduling)
+    return {"message": "Batch evaluation queued.", "job_id": job.id}
+
+def format_event(payload, stream_format):
+    if stream_format == "sse":
+        return f"event: {payload['event']}\ndata: {json.dumps(payload)}\n\n"
+    return json.dumps(payload) + "\n"
+
+
+def stream_events(job, events, stream_format):
+    score_sums = defaultdict(int)
+    score_counts = defaultdict(int)
+    completed = failed = 0
+    try:
+        while True:
+            try:
+                event = events.get(timeout=STREAM_POLL_SECONDS)
+            except queue.Empty:
+                # the job may have been cancelled before it ever ran
+                if job.status in FINISHED:
+                    break
+                continue
+            if event is STREAM_END:
+                break
+
+            chunk, output = event
+            if output is None:
+                failed += 1
+                yield format_event({"event": "error", "chunk_id": chunk.id, "file": chunk.file}, stream_format)
+                continue
+
+            completed += 1
+            result = json.loads(output)
+            for key, value in result.items():
+                if isinstance(value, dict) and 'score' in value:
+                    score_sums[key] += value['score']
+                    score_counts[key] += 1
+            aggregate = {key: round(score_sums[key] / score_counts[key], 2) for key in score_sums}
+            yield format_event({
+                "event": "chunk",
+                "chunk_id": chunk.id,
+                "file": chunk.file,
+                "result": result,
+                "aggregate": {"chunks": completed, "failed": failed, "scores_by_category": aggregate},
+            }, stream_format)
+
+        while job.status not in FINISHED:
+            time.sleep(0.05)
+        yield format_event({
+            "event": "summary",
+            "status": job.status,
+            "error": job.error,
+            "chunks": completed,
+            "failed": failed,
+            "scores": (job.result or {}).get("scores"),
+        }, stream_format)
+    finally:
+        # client went away mid-stream
+        if job.status not in FINISHED:
+            JOBS.cancel(job.id)
+
+
+@app.post("/analyze/stream")
+def analyze_code_stream(data: AnalysisRequest, format: str = "ndjson"):
+    check_analysis_types(data.analysis_type)
+    repo_path = GitHandler(BASE_PATH).repo_path(data.url)
+    events = queue.Queue()
+
+    def run(job):
+        try:
+            with MIRRORS.using(data.url):
+                code_analyser = analyze_repository(
+                    repo_path, data.analysis_type, batch_tokens=data.batch_tokens, max_workers=MAX_CONCURRENCY, cache=RESULT_CACHE,
+                    result_store=RESULT_STORE, dedup=DEDUP_INDEX if data.dedup else None, progress=job.update_progress,
+                    cancel_event=job.cancel_event, timings=job.timings,
+                    triage=TriagePolicy() if data.triage else None, compact=data.compact, max_calls=data.max_calls,
+                    ci_width=data.ci_width, sample_calls=data.sample_calls,
+                    on_result=lambda chunk, output: events.put((chunk, output)),
+                )
+            return {"repo": repo_path, "scores": read_scores_summary(repo_path), "dedup": code_analyser.dedup_report, "triage": code_analyser.triage_report,
+                "hierarchy": getattr(code_analyser, "hierarchy", None), "estimate": getattr(code_analyser, "estimate", None)}
+        finally:
+            events.put(STREAM_END)
+
+    job = JOBS.submit("analyze", repo_path, run, url=data.url, analysis_type=data.analysis_type, batch_tokens=data.batch_tokens, dedup=data.dedup, triage=data.triage,
+                      compact=data.compact, max_calls=data.max_calls, ci_width=data.ci_width, sample_calls=data.sample_calls)
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(stream_events(job, events, format), media_type=media_type, headers={"X-Job-Id": job.id})
+
+@app.post("/remarks")
+def fetch_remarks(data: RemarksRequest):
+    # full reviews for a handful of chunks, usually after a compact run; answered inline, so the count is capped
+    check_analysis_types(data.analysis_type)
+    if len(data.chunk_ids) > MAX_REMARKS_CHUNKS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_REMARKS_CHUNKS} chunks per request.")
+    repo_path = GitHandler(BASE_PATH).repo_path(data.url)
+    if not os.path.isdir(os.path.join(repo_path, "chunk_data")):
+        raise HTTPException(status_code=404, detail="Repository not initialized.")
+    code_analyser = CodeAnalyser(data.analysis_type, max_workers=MAX_CONCURRENCY, cache=RESULT_CACHE)
+    with MIRRORS.using(data.url):
+        remarks = code_analyser.remarks(repo_path, data.chunk_ids)
+    return {
+        "analysis_type": data.analysis_type,
+        "remarks": remarks,
+        # ids the chunk store does not know, e.g. from before the file was re-chunked
+        "missing": [chunk_id for chunk_id in dict.fromkeys(data.chunk_ids) if chunk_id not in remarks],
+    }
+
+@app.get("/results")
+def query_results(url: str, analysis_type: str = "code_quality", path: str = None, chunk_id: str = None,
+                  where: List[str] = Query(default=[]), sort: str = None, limit: int = DEFAULT_LIMIT, offset: int = 0,
+                  fields: str = None):
+    # e.g. /results?url=...&analysis_type=code_security&path=src/api&where=security<4&sort=security&fields=chunk_id,file,scores
+    repo_path = GitHandler(BASE_PATH).repo_path(url)
+    index_existing_results(repo_path, analysis_type)
+    try:
+        page = RESULT_STORE.query(
+            repo_path, analysis_type, path=path, chunk_id=chunk_id, where=where, sort=sort, limit=limit, offset=offset,
+            fields=[field.strip() for field in fields.split(",") if field.strip()] if fields else None,
+        )
+    except QueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"repo": repo_path, "analysis_type": analysis_type, **page}
+
+@app.get("/rankings")
+def rankings(analysis_type: str = "code_quality", category: str = None):
+    # dot directories hold the mirror cache, not evaluated repos
+    names = sorted(name for name in os.listdir(BASE_PATH) if not name.startswith(".")) if os.path.isdir(BASE_PATH) else []
+    summaries = {name: read_mode_summary(os.path.join(BASE_PATH, name), analysis_type) for name in names}
+    return {"analysis_type": analysis_type, "category": category, "rankings": rank_repositories(summaries, category)}
+
+@app.get("/jobs")
+def list_jobs(url: str = None):
+    repo_path = GitHandler(BASE_PATH).repo_path(url) if url else None
+    return {"jobs": [job.to_dict() for job in JOBS.list(repo_path)]}
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    return get_job(job_id).to_dict()
+
+@app.get("/jobs/{job_id}/result")
+def job_result(job_id: str):
+    job = get_job(job_id)
+    if job.status != SUCCEEDED:
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}.")
+    timings = {"stages": job.timings, "total_seconds": round(job.finished - job.started, 3)}
+    if job.kind == "analyze":
+        # per-chunk results are paged through /results instead of being returned in full
+        indexed = RESULT_STORE.count(job.repo, job.params["analysis_type"])
+        return {"message": "Repository analyzed.", **job.result, "indexed_results": indexed, "timings": timings}
+    if job.kind == "init":
+        return {"message": "Repository initialized.", **job.result, "timings": timings}
+    if job.kind == "batch":
+        return {"message": "Batch evaluated.", **job.result, "timings": timings}
+    return {"message": "Repository analyzed.", **job.result, "timings": timings}
+
+@app.delete("/jobs/{job_id}")
+def cancel_job(job_id: str):
+    job = get_job(job_id)
+    JOBS.cancel(job_id)
+    return job.to_dict()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    JOBS_BY_STATUS.clear()
+    counts = defaultdict(int)
+    for job in JOBS.list():
+        counts[(job.kind, job.status)] += 1
+    for (kind, status), count in counts.items():
+        JOBS_BY_STATUS.set(count, kind=kind, status=status)
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
 
 if __name__ == "__main__":
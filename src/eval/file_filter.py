@@ -0,0 +1,274 @@
+import os
+import re
+import logging
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+MAX_FILE_BYTES = 256 * 1024
+MAX_REPO_BYTES = 32 * 1024 * 1024
+HEAD_BYTES = 8192
+MINIFIED_AVG_LINE = 300
+MINIFIED_MAX_LINE = 2000
+
+VENDORED_PATTERNS = [
+    "node_modules/", "bower_components/", "vendor/", "vendors/", "third_party/", "third-party/",
+    "dist/", "build/", "target/", ".venv/", "venv/", "site-packages/",
+    "__pycache__/", ".next/", ".nuxt/", "coverage/", "Pods/", "*.min.js", "*.min.css",
+    "*.bundle.js", "*.map",
+]
+LOCKFILES = {
+    "package-lock.json", "yarn.lock", "pnpm-lock.yaml", "poetry.lock", "Pipfile.lock", "Cargo.lock",
+    "composer.lock", "Gemfile.lock", "go.sum", "mix.lock", "pubspec.lock", "packages.lock.json",
+}
+GENERATED_PATTERNS = [
+    "*_pb2.py", "*_pb2_grpc.py", "*.pb.go", "*.pb.cc", "*.pb.h", "*.pb.js", "*_grpc.pb.go",
+    "*.generated.*", "*_generated.*", "*.g.dart", "*.designer.cs",
+]
+GENERATED_MARKERS = re.compile(rb"(DO NOT EDIT|@generated|[Aa]uto-?generated|[Gg]enerated by)")
+
+
+@dataclass
+class FilterConfig:
+    max_file_bytes: int = MAX_FILE_BYTES
+    max_repo_bytes: int = MAX_REPO_BYTES
+    use_gitignore: bool = True
+    use_gitattributes: bool = True
+    skip_vendored: bool = True
+    skip_generated: bool = True
+    skip_lockfiles: bool = True
+    skip_minified: bool = True
+    skip_binary: bool = True
+    exclude: List[str] = field(default_factory=list)
+
+
+def glob_to_regex(pattern: str) -> str:
+    i, out = 0, []
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            out.append("(?:.*/)?")
+            i += 3
+            continue
+        if pattern.startswith("**", i):
+            out.append(".*")
+            i += 2
+            continue
+        if c == "*":
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[" and "]" in pattern[i + 1:]:
+            j = pattern.index("]", i + 1)
+            body = pattern[i + 1:j]
+            if body.startswith("!"):
+                body = "^" + body[1:]
+            out.append(f"[{body}]")
+            i = j + 1
+            continue
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return "".join(out)
+
+
+class PathRule:
+    # one gitignore-style pattern, relative to the directory of the file that declared it
+    def __init__(self, base: str, pattern: str):
+        self.base = base.strip("/")
+        self.negate = pattern.startswith("!")
+        pattern = pattern[1:] if self.negate else pattern
+        self.dir_only = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+        anchored = "/" in pattern
+        pattern = pattern.lstrip("/")
+        prefix = "^" if anchored else "(?:^|.*/)"
+        self.regex = re.compile(prefix + glob_to_regex(pattern) + "$")
+
+    def matches(self, rel_path: str, is_dir: bool) -> bool:
+        if self.dir_only and not is_dir:
+            return False
+        if self.base:
+            if not rel_path.startswith(self.base + "/"):
+                return False
+            rel_path = rel_path[len(self.base) + 1:]
+        return bool(self.regex.match(rel_path))
+
+
+class FilterReport:
+    def __init__(self):
+        self.skipped: Dict[str, str] = {}
+        self.accepted = 0
+        self.accepted_bytes = 0
+
+    def skip(self, rel_path: str, reason: str):
+        self.skipped[rel_path] = reason
+
+    def counts(self) -> Dict[str, int]:
+        return dict(Counter(self.skipped.values()))
+
+    def to_dict(self):
+        return {
+            "accepted": self.accepted,
+            "accepted_bytes": self.accepted_bytes,
+            "skipped_by_reason": self.counts(),
+            "skipped": self.skipped,
+        }
+
+
+class FileFilter:
+    def __init__(self, config: FilterConfig = None, skip_names=()):
+        self.logger = logging.getLogger(__name__)
+        self.config = config or FilterConfig()
+        self.skip_names = set(skip_names)
+        self.ignore_rules: List[PathRule] = []
+        self.attribute_rules: List[tuple] = []
+        self.vendored_rules = [PathRule("", pattern) for pattern in VENDORED_PATTERNS]
+        self.generated_rules = [PathRule("", pattern) for pattern in GENERATED_PATTERNS]
+        self.exclude_rules = [PathRule("", pattern) for pattern in self.config.exclude]
+        self.report = FilterReport()
+        self._loaded_dirs = set()
+
+    def add_ignore_file(self, base: str, text: str):
+        for line in text.splitlines():
+            line = line.rstrip()
+            if line and not line.startswith("#"):
+                self.ignore_rules.append(PathRule(base, line))
+
+    def add_attributes_file(self, base: str, text: str):
+        for line in text.splitlines():
+            parts = line.split()
+            if not parts or parts[0].startswith("#"):
+                continue
+            attributes = {}
+            for attribute in parts[1:]:
+                if attribute.startswith("-"):
+                    attributes[attribute[1:]] = False
+                elif "=" in attribute:
+                    name, value = attribute.split("=", 1)
+                    attributes[name] = value.lower() not in ("false", "0")
+                else:
+                    attributes[attribute] = True
+            self.attribute_rules.append((PathRule(base, parts[0]), attributes))
+
+    def _ignored(self, rel_path: str, is_dir: bool) -> bool:
+        ignored = False
+        for rule in self.ignore_rules:
+            if rule.matches(rel_path, is_dir):
+                ignored = not rule.negate
+        return ignored
+
+    def _attribute(self, rel_path: str, name: str) -> bool:
+        value = False
+        for rule, attributes in self.attribute_rules:
+            if name in attributes and rule.matches(rel_path, False):
+                value = attributes[name]
+        return value
+
+    def check_directory(self, rel_path: str) -> Optional[str]:
+        if os.path.basename(rel_path) in self.skip_names:
+            return "artifact"
+        if any(rule.matches(rel_path, True) for rule in self.exclude_rules):
+            return "excluded"
+        if self.config.use_gitignore and self._ignored(rel_path, True):
+            return "gitignore"
+        if self.config.skip_vendored and any(rule.matches(rel_path, True) for rule in self.vendored_rules):
+            return "vendored"
+        return None
+
+    def skip_directory(self, rel_path: str) -> bool:
+        reason = self.check_directory(rel_path)
+        if reason is not None and reason != "artifact":
+            self.report.skip(rel_path + "/", reason)
+        return reason is not None
+
+    def check_path(self, rel_path: str) -> Optional[str]:
+        name = os.path.basename(rel_path)
+        if name in self.skip_names:
+            return "artifact"
+        if any(rule.matches(rel_path, False) for rule in self.exclude_rules):
+            return "excluded"
+        if self.config.use_gitignore and self._ignored(rel_path, False):
+            return "gitignore"
+        if self.config.skip_lockfiles and name in LOCKFILES:
+            return "lockfile"
+        if self.config.skip_vendored:
+            if any(rule.matches(rel_path, False) for rule in self.vendored_rules):
+                return "vendored"
+            if self.config.use_gitattributes and self._attribute(rel_path, "linguist-vendored"):
+                return "vendored"
+        if self.config.skip_generated:
+            if any(rule.matches(rel_path, False) for rule in self.generated_rules):
+                return "generated"
+            if self.config.use_gitattributes and self._attribute(rel_path, "linguist-generated"):
+                return "generated"
+        if self.config.skip_binary and self.config.use_gitattributes and self._attribute(rel_path, "binary"):
+            return "binary"
+        return None
+
+    def check_content(self, size: int, head: bytes) -> Optional[str]:
+        if self.config.max_file_bytes and size > self.config.max_file_bytes:
+            return "too_large"
+        if self.config.skip_binary and b"\0" in head:
+            return "binary"
+        if self.config.skip_generated and GENERATED_MARKERS.search(head[:1024]):
+            return "generated"
+        if self.config.skip_minified and head:
+            lines = head.split(b"\n")
+            if len(head) / len(lines) > MINIFIED_AVG_LINE or max(len(line) for line in lines) > MINIFIED_MAX_LINE:
+                return "minified"
+        return None
+
+    def check(self, rel_path: str, size: int, read_head: Callable[[], bytes]) -> bool:
+        # read_head is only called once the cheap path checks pass
+        reason = self.check_path(rel_path)
+        if reason is None and self.config.max_file_bytes and size > self.config.max_file_bytes:
+            reason = "too_large"
+        if reason is None:
+            reason = self.check_content(size, read_head())
+        if reason is None and self.config.max_repo_bytes and self.report.accepted_bytes + size > self.config.max_repo_bytes:
+            reason = "repo_budget"
+
+        if reason is None:
+            self.report.accepted += 1
+            self.report.accepted_bytes += size
+            return True
+        if reason != "artifact":
+            self.report.skip(rel_path, reason)
+        return False
+
+    def load_rules_for(self, root: str, rel_path: str) -> Optional[str]:
+        # for checking single paths without a walk: loads rules from every ancestor directory
+        # and returns the reason if one of those directories is itself skipped
+        parts = rel_path.split("/")[:-1]
+        for depth in range(len(parts) + 1):
+            rel_dir = "/".join(parts[:depth])
+            reason = self.check_directory(rel_dir) if rel_dir else None
+            if reason is not None:
+                return reason
+            if rel_dir in self._loaded_dirs:
+                continue
+            self._loaded_dirs.add(rel_dir)
+            for name, loader in ((".gitignore", self.add_ignore_file), (".gitattributes", self.add_attributes_file)):
+                path = os.path.join(root, rel_dir, name)
+                if os.path.isfile(path):
+                    with open(path, "r", encoding="utf-8", errors="replace") as f:
+                        loader(rel_dir, f.read())
+        return None
+
+    def walk(self, root: str):
+        # yields repo-relative posix paths, pruning skipped directories and picking up
+        # .gitignore/.gitattributes files on the way down
+        for dirpath, dirnames, filenames in os.walk(root):
+            rel_dir = os.path.relpath(dirpath, root).replace(os.sep, "/")
+            rel_dir = "" if rel_dir == "." else rel_dir
+            for name, loader in ((".gitignore", self.add_ignore_file), (".gitattributes", self.add_attributes_file)):
+                if name in filenames:
+                    with open(os.path.join(dirpath, name), "r", encoding="utf-8", errors="replace") as f:
+                        loader(rel_dir, f.read())
+            dirnames[:] = sorted(d for d in dirnames if not self.skip_directory(f"{rel_dir}/{d}".lstrip("/")))
+            for name in sorted(filenames):
+                yield f"{rel_dir}/{name}".lstrip("/")
+
+    def log_report(self):
+        self.logger.info(f"Filter accepted {self.report.accepted} files ({self.report.accepted_bytes} bytes), skipped {self.report.counts()}")
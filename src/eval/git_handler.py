@@ -1,30 +1,110 @@
 import pygit2
-from typing import List
+from typing import Iterator, List, Optional, Tuple
 import logging
 import os
 import shutil
+import hashlib
+from .mirror_cache import normalize_url
+
+URL_HASH_LENGTH = 12
 
 class GitHandler:
-    def __init__(self, base_path: str = "./cloned_repos"):
+    def __init__(self, base_path: str = "./cloned_repos", mirrors=None):
+        # mirrors: an optional MirrorCache, working copies are then cloned from a local mirror
         self.base_path = base_path
+        self.mirrors = mirrors
         self.logger = logging.getLogger(__name__)
 
-    def clone_repository(self, url: str) -> pygit2.Repository:
-        path = os.path.join(self.base_path, url.split("/")[-1])
+    def repo_path(self, url: str) -> str:
+        # the name keeps the directory readable, the hash of the full URL keeps forks named alike apart
+        repo_name = os.path.splitext(url.rstrip("/").split("/")[-1])[0]
+        digest = hashlib.sha256(normalize_url(url).encode("utf-8")).hexdigest()[:URL_HASH_LENGTH]
+        return os.path.join(self.base_path, f"{repo_name}-{digest}")
+
+    def is_repository(self, path: str) -> bool:
+        if os.path.exists(os.path.join(path, '.git')):
+            return True
+        # bare repositories keep HEAD and objects at the top level
+        return os.path.exists(os.path.join(path, 'HEAD')) and os.path.isdir(os.path.join(path, 'objects'))
+
+    def clone_repository(self, url: str, bare: bool = False, depth: int = 0) -> pygit2.Repository:
+        # bare=True skips the working-tree checkout, depth=1 skips history
+        if self.mirrors is None:
+            return self._clone_or_update(url, url, bare, depth)
+        with self.mirrors.using(url):
+            # only the mirror talks to the remote; the working copy is a local clone of it, so history is cheap
+            source = self.mirrors.ensure(url)
+            with self.mirrors.repo_lock(url):
+                repo = self._clone_or_update(url, source, bare, 0)
+            self.mirrors.touch(url, self.repo_path(url))
+            return repo
+
+    def _clone_or_update(self, url: str, source: str, bare: bool, depth: int) -> pygit2.Repository:
+        path = self.repo_path(url)
         try:
             if os.path.exists(path):
-                if os.path.exists(os.path.join(path, '.git')):
+                repo = pygit2.Repository(path) if self.is_repository(path) else None
+                if repo is not None and repo.is_bare != bare:
+                    # a bare clone has no files to chunk and a checkout would be chunked from disk, so a layout
+                    # change starts over with a fresh clone, chunks and outputs included
+                    self.logger.warning(f"Repository at {path} is {'bare' if repo.is_bare else 'checked out'}, re-cloning")
+                    repo.free()
+                    shutil.rmtree(path)
+                elif repo is not None:
                     self.logger.info(f"Repository already exists at path: {path}")
+                    if repo.remotes["origin"].url != source:
+                        repo.remotes.set_url("origin", source)
+                    self.update_repository(repo, depth if repo.is_shallow else 0)
+                    return repo
                 else:
                     self.logger.warning(f"Directory exists but is not a Git repository: {path}")
                     shutil.rmtree(path)
             
             self.logger.info(f"Cloning repository to: {path}")
-            pygit2.clone_repository(url, path)
+            return pygit2.clone_repository(source, path, bare=bare, depth=depth)
 
         except pygit2.GitError as e:
             self.logger.error(f"Error while cloning repository: {e}")
             raise e
+
+    def update_repository(self, repo: pygit2.Repository, depth: int = 0) -> pygit2.Commit:
+        try:
+            repo.remotes["origin"].fetch(depth=depth)
+            branch = repo.head.shorthand
+            remote_ref = repo.lookup_reference(f"refs/remotes/origin/{branch}")
+            commit = repo[remote_ref.target].peel(pygit2.Commit)
+            if repo.is_bare:
+                repo.lookup_reference(f"refs/heads/{branch}").set_target(commit.id)
+            else:
+                repo.reset(commit.id, pygit2.enums.ResetMode.HARD)
+            self.logger.info(f"Updated {branch} to {commit.id}")
+            return commit
+        except (pygit2.GitError, KeyError) as e:
+            self.logger.error(f"Error while updating repository: {e}")
+            raise e
+
+    def changed_files(self, repo: pygit2.Repository, old_commit: str, new_commit: str) -> Optional[Tuple[List[str], List[str]]]:
+        # returns (added or modified paths, deleted paths); renames count as both
+        try:
+            old = repo.revparse_single(old_commit).peel(pygit2.Commit)
+            new = repo.revparse_single(new_commit).peel(pygit2.Commit)
+        except (KeyError, ValueError, pygit2.GitError):
+            self.logger.warning(f"Cannot diff {old_commit}..{new_commit}, falling back to a full run")
+            return None
+
+        diff = repo.diff(old, new)
+        diff.find_similar()
+        changed, removed = set(), set()
+        for delta in diff.deltas:
+            status = delta.status_char()
+            if status == 'D':
+                removed.add(delta.old_file.path)
+            elif status == 'R':
+                removed.add(delta.old_file.path)
+                changed.add(delta.new_file.path)
+            else:
+                changed.add(delta.new_file.path)
+        return sorted(changed), sorted(removed)
         
     def get_latest_commit(self, repo: pygit2.Repository) -> pygit2.Commit:
         try:
@@ -35,11 +115,28 @@ class GitHandler:
 
     def get_file_content(self, repo: pygit2.Repository, file_path: str) -> str:
         try:
-            file = repo[file_path]
+            tree = self.get_latest_commit(repo).tree
+            file = repo[tree[file_path].id]
             return file.data.decode("utf-8")
-        except pygit2.GitError as e:
+        except (pygit2.GitError, KeyError) as e:
             self.logger.error(f"Error while getting file content: {e}")
             raise e
+
+    def iter_blobs(self, repo: pygit2.Repository, commit: pygit2.Commit = None, skip_dir=None) -> Iterator[Tuple[str, pygit2.Blob]]:
+        # walks the commit tree straight from the object database, no checkout needed;
+        # skip_dir(path) -> True prunes a whole subtree before any of its objects are read
+        commit = commit or self.get_latest_commit(repo)
+        stack = [(commit.tree, "")]
+        while stack:
+            tree, prefix = stack.pop()
+            for entry in tree:
+                path = f"{prefix}{entry.name}"
+                if entry.type_str == "tree":
+                    if skip_dir is None or not skip_dir(path):
+                        stack.append((repo[entry.id], f"{path}/"))
+                elif entry.type_str == "blob":
+                    # tree entries load their data lazily, so pruned or filtered blobs are never read
+                    yield path, entry
         
     def flush_all(self):
         #remove all folders and files in base path
@@ -0,0 +1,196 @@
+import os
+import json
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from ..models.code_descriptor_model import CodeDescriptorModel
+from ..models.hierarchical_model import DigestModel, leaf_prompt, merge_prompt, repo_prompt_suffix
+from .code_analyser import CallBudgetExceeded, CodeAnalyser, GROQ_CHEAP_MODEL, GROQ_MODEL
+from .metrics import timed
+from .result_cache import ResultCache
+from .score_aggregator import chunk_scores
+
+LEAF_TOKENS = 6000
+DIGEST_TOKENS = 400
+# digests per merge call, wide enough to keep the tree shallow and narrow enough for one context window
+MAX_FANOUT = 16
+MIN_CALLS = 2
+HIERARCHY_FILE = "hierarchy.json"
+REPO_EVALUATION_FILE = "repo_evaluation.json"
+
+
+def reduce_calls(nodes: int, fanout: int) -> int:
+    # merge calls needed until at most fanout digests are left for the final evaluation
+    calls = 0
+    while nodes > fanout:
+        nodes = math.ceil(nodes / fanout)
+        calls += nodes
+    return calls
+
+
+def plan_tree(file_count: int, max_calls: int, max_fanout: int = MAX_FANOUT):
+    # (leaf calls, fan-out). One leaf per file under the narrowest fan-out that fits, since narrow merges lose
+    # less; if no fan-out fits, as many leaves as the cap leaves room for at the widest one
+    budget = max_calls - 1
+    for fanout in range(2, max_fanout + 1):
+        if file_count + reduce_calls(file_count, fanout) <= budget:
+            return file_count, fanout
+    leaves = min(file_count, budget)
+    while leaves > 1 and leaves + reduce_calls(leaves, max_fanout) > budget:
+        leaves -= 1
+    return leaves, max_fanout
+
+
+def split_even(items, parts: int):
+    # contiguous runs of nearly equal length, so neighbouring paths stay in the same group
+    size, extra = divmod(len(items), parts)
+    groups, start = [], 0
+    for i in range(parts):
+        end = start + size + (1 if i < extra else 0)
+        groups.append(items[start:end])
+        start = end
+    return groups
+
+
+def common_scope(files) -> str:
+    directories = [file.split("/")[:-1] for file in files]
+    prefix = os.path.commonprefix(directories) if directories else []
+    return "/".join(prefix) or "."
+
+
+class HierarchicalAnalyser(CodeAnalyser):
+    # summarises files on the cheap model, merges the summaries into digests along the sorted paths, then runs
+    # the mode's review once over the last digests; the whole run makes at most max_calls requests
+    def __init__(self, analysis_mode: str, max_calls: int, max_fanout: int = MAX_FANOUT, **kwargs):
+        super().__init__(analysis_mode, **kwargs)
+        if max_calls < MIN_CALLS:
+            raise ValueError(f"max_calls must be at least {MIN_CALLS}")
+        self.max_calls = max_calls
+        self.max_fanout = max_fanout
+        self.calls = 0
+        # requests held back for the final evaluation while the digests are made
+        self.reserved = 1
+        self.calls_lock = threading.Lock()
+        self.hierarchy = None
+
+    def process_repo(self, repo_path, files=None):
+        # files is ignored, the tree is rebuilt every run and unchanged leaves come back from the result cache
+        self.calls = 0
+        self.reserved = 1
+        chunks_by_file = {}
+        for chunk in self.load_chunks(repo_path):
+            chunks_by_file.setdefault(chunk.file, []).append(chunk)
+        paths = sorted(chunks_by_file)
+        if not paths:
+            self.logger.info(f"No chunks to evaluate in {repo_path}")
+            return
+
+        leaf_count, fanout = plan_tree(len(paths), self.max_calls, self.max_fanout)
+        planned = leaf_count + reduce_calls(leaf_count, fanout) + 1
+        self.logger.info(f"Hierarchical plan for {len(paths)} files: {leaf_count} leaves, fan-out {fanout}, {planned} calls")
+        self.hierarchy = {"files": len(paths), "leaves": leaf_count, "fanout": fanout, "max_calls": self.max_calls,
+                          "planned_calls": planned, "levels": []}
+
+        with timed("analyze", self.timings):
+            nodes = [(group, self.leaf_content(group, chunks_by_file)) for group in split_even(paths, leaf_count)]
+            digests = self.summarise_level(nodes, leaf_prompt, planned)
+            while len(digests) > fanout and not self.cancelled():
+                groups = split_even(digests, math.ceil(len(digests) / fanout))
+                nodes = [([file for files, _ in group for file in files], self.merge_content(group)) for group in groups]
+                digests = self.summarise_level(nodes, merge_prompt, planned)
+            if self.cancelled():
+                self.logger.info(f"Analysis of {repo_path} cancelled")
+                return
+            self.reserved = 0
+            evaluation = self.evaluate(digests)
+
+        self.hierarchy["calls"] = self.calls
+        output_folder = os.path.join(repo_path, self.output_dir)
+        os.makedirs(output_folder, exist_ok=True)
+        with open(os.path.join(output_folder, HIERARCHY_FILE), "w") as f:
+            json.dump(self.hierarchy, f, indent=2)
+        with open(os.path.join(output_folder, REPO_EVALUATION_FILE), "w") as f:
+            json.dump(evaluation, f, indent=2)
+        if self.progress is not None:
+            self.progress("evaluate", planned, planned)
+        self.final_scores(repo_path, evaluation)
+
+    def leaf_content(self, files, chunks_by_file):
+        # each file gets an equal share of the leaf budget, long files are cut at a line boundary
+        budget = LEAF_TOKENS * 4 // len(files)
+        parts = []
+        for file in files:
+            text = "\n".join(chunk.text for chunk in sorted(chunks_by_file[file], key=lambda chunk: chunk.index))
+            if len(text) > budget:
+                kept = text[:budget].rsplit("\n", 1)[0]
+                text = f"{kept}\n... (truncated, {text.count(chr(10)) - kept.count(chr(10))} more lines)"
+            parts.append(f'<file path="{file}">\n{text}\n</file>')
+        return "\n\n".join(parts)
+
+    def merge_content(self, group):
+        return "\n\n".join(f'<digest scope="{common_scope(files)}">\n{digest}\n</digest>' for files, digest in group if digest)
+
+    def summarise_level(self, nodes, prompt, planned):
+        # [(files, content)] -> [(files, digest or None)], one cheap call per node, in order
+        with ThreadPoolExecutor(max_workers=self.concurrency.maximum) as executor:
+            digests = list(executor.map(lambda node: self.summarise(node[1], prompt, planned), nodes))
+        level = [(files, digest) for (files, _), digest in zip(nodes, digests)]
+        self.hierarchy["levels"].append([{"scope": common_scope(files), "files": len(files), "digest": digest} for files, digest in level])
+        return level
+
+    def summarise(self, content: str, prompt: str, planned: int):
+        if self.cancelled() or not content:
+            return None
+        key = ResultCache.make_key(content, "hierarchical_digest", GROQ_CHEAP_MODEL, prompt)
+        digest = self.cache.get(key) if self.cache is not None else None
+        if digest is None:
+            try:
+                digest = self.call(content, prompt, DigestModel, DIGEST_TOKENS, GROQ_CHEAP_MODEL, planned).digest
+            except Exception as e:
+                self.logger.error(f"Error summarising repository part: {str(e)}")
+                return None
+            if self.cache is not None:
+                self.cache.put(key, digest)
+        return digest
+
+    def call_backend(self, code: str, sys_prompt: str, response_model=None, model: str = GROQ_MODEL):
+        # every request counts against max_calls, retries included, and none goes out once they are spent
+        with self.calls_lock:
+            if self.calls >= self.max_calls - self.reserved:
+                raise CallBudgetExceeded(f"All {self.max_calls} calls spent")
+            self.calls += 1
+        return super().call_backend(code, sys_prompt, response_model, model)
+
+    def call(self, content, prompt, response_model, completion_tokens, model, planned):
+        output = self.get_output(content, prompt, response_model, completion_tokens, model=model)
+        if self.progress is not None:
+            self.progress("summarize", min(self.calls, planned), planned)
+        return output
+
+    def evaluate(self, digests):
+        content = self.merge_content(digests)
+        if not content:
+            raise RuntimeError("Every repository digest failed, nothing left to evaluate")
+        prompt = self.sys_prompt + repo_prompt_suffix
+        key = ResultCache.make_key(content, self.analysis_mode, GROQ_MODEL, prompt)
+        output = self.cache.get(key) if self.cache is not None else None
+        if output is None:
+            output = self.call(content, prompt, self.response_model, None, GROQ_MODEL, self.hierarchy["planned_calls"]).model_dump_json(indent=2)
+            if self.cache is not None:
+                self.cache.put(key, output)
+        return json.loads(output)
+
+    def final_scores(self, repo_path, evaluation=None):
+        if self.response_model is CodeDescriptorModel or evaluation is None:
+            return
+        scores = chunk_scores(evaluation)
+        summary = {
+            "scores_by_category": scores,
+            "overall": round(sum(scores.values()) / len(scores), 2) if scores else None,
+            "evaluation": "hierarchical",
+            "hierarchy": {key: value for key, value in self.hierarchy.items() if key != "levels"},
+        }
+        output_file = os.path.join(repo_path, self.output_dir, "scores_summary.json")
+        with open(output_file, "w") as f:
+            json.dump(summary, f, indent=2)
+        self.logger.info(f"Scores summary saved to: {output_file}")
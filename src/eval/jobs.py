@@ -0,0 +1,132 @@
+import time
+import uuid
+import logging
+import threading
+import weakref
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+MAX_JOB_WORKERS = 4
+MAX_FINISHED_JOBS = 1000
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class Job:
+    def __init__(self, kind: str, repo: str, params: dict):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.repo = repo
+        self.params = params
+        self.status = QUEUED
+        self.progress = {"stage": None, "done": 0, "total": 0}
+        self.result = None
+        self.timings = {}
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel_event = threading.Event()
+
+    def update_progress(self, stage: str, done: int, total: int):
+        self.progress = {"stage": stage, "done": done, "total": total}
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "repo": self.repo,
+            "params": self.params,
+            "status": self.status,
+            "progress": self.progress,
+            "timings": self.timings,
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+class JobManager:
+    # jobs for the same repo run one after another in submission order, different repos run in parallel
+    def __init__(self, max_workers: int = MAX_JOB_WORKERS):
+        self.logger = logging.getLogger(__name__)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.lock = threading.Lock()
+        self.jobs: Dict[str, Job] = {}
+        self.repo_queues: Dict[str, deque] = {}
+        # a lock lives as long as someone holds on to it, so finished batches do not pile them up
+        self.repo_locks = weakref.WeakValueDictionary()
+
+    def repo_lock(self, repo: str) -> threading.Lock:
+        # held by a job while it runs, and by work outside the job queues (a batch's repos) that writes to the repo
+        with self.lock:
+            lock = self.repo_locks.get(repo)
+            if lock is None:
+                lock = self.repo_locks[repo] = threading.Lock()
+            return lock
+
+    def submit(self, kind: str, repo: str, fn: Callable[[Job], object], **params) -> Job:
+        job = Job(kind, repo, params)
+        with self.lock:
+            self._prune()
+            self.jobs[job.id] = job
+            queue = self.repo_queues.setdefault(repo, deque())
+            queue.append((job, fn))
+            if len(queue) == 1:
+                self.executor.submit(self._run, job, fn)
+        return job
+
+    def _run(self, job: Job, fn):
+        try:
+            if job.cancel_event.is_set():
+                job.status = CANCELLED
+                return
+            with self.repo_lock(job.repo):
+                job.status = RUNNING
+                job.started = time.time()
+                job.result = fn(job)
+            job.status = CANCELLED if job.cancel_event.is_set() else SUCCEEDED
+        except Exception as e:
+            self.logger.error(f"Job {job.id} ({job.kind} {job.repo}) failed: {str(e)}", exc_info=True)
+            job.status = FAILED
+            job.error = str(e)
+        finally:
+            job.finished = time.time()
+            with self.lock:
+                queue = self.repo_queues[job.repo]
+                queue.popleft()
+                if queue:
+                    self.executor.submit(self._run, *queue[0])
+                else:
+                    del self.repo_queues[job.repo]
+
+    def _prune(self):
+        finished = [job for job in self.jobs.values() if job.status in FINISHED]
+        for job in sorted(finished, key=lambda job: job.finished or 0)[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job.id]
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    def list(self, repo: str = None) -> List[Job]:
+        return [job for job in list(self.jobs.values()) if repo is None or job.repo == repo]
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        job = self.jobs.get(job_id)
+        if job is not None and job.status not in FINISHED:
+            job.cancel_event.set()
+            if job.status == QUEUED:
+                job.status = CANCELLED
+        return job
+
+    def shutdown(self):
+        for job in self.list():
+            job.cancel_event.set()
+        self.executor.shutdown(wait=False)
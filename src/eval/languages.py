@@ -4,7 +4,7 @@ languageExtensions = {
         'el': 'elisp',
         'Makefile': 'make',
         'Dockerfile': 'dockerfile',
-        'go.mod': 'go mod',
+        'go.mod': 'gomod',
         'ex': 'elixir',
         'elm': 'elm',
         'kt': 'kotlin',
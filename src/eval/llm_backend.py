@@ -0,0 +1,194 @@
+import os
+import re
+import time
+import random
+import threading
+import typing
+from typing import List, Type
+import groq
+from groq import Groq
+import instructor
+from pydantic import BaseModel
+from .metrics import LLM_TOKENS
+from .rate_limiter import estimate_tokens
+from .result_cache import sha256
+
+_client = None
+_client_lock = threading.Lock()
+_backend = None
+_backend_lock = threading.Lock()
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 60.0
+DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+
+
+def get_client():
+    # one pooled client shared by every analyser and worker thread in the process; the SDK's own
+    # retries are off so that 429s reach the adaptive controller in CodeAnalyser.get_output
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = instructor.from_groq(Groq(api_key=os.getenv("GROQ_API_KEY"), max_retries=0), mode=instructor.Mode.TOOLS)
+        return _client
+
+
+class BackendError(Exception):
+    # carries what the caller needs to back off: the HTTP status and the response headers
+    def __init__(self, message: str, status_code: int = 500, headers: dict = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+def error_status(error):
+    return getattr(error, "status_code", None)
+
+
+def error_headers(error) -> dict:
+    headers = getattr(error, "headers", None)
+    if headers is None:
+        headers = getattr(getattr(error, "response", None), "headers", None)
+    return {key.lower(): value for key, value in (headers or {}).items()}
+
+
+def parse_duration(value) -> float:
+    # plain seconds ("7") or Groq's reset format ("2m59.56s", "7.66s", "450ms")
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    units = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+    parts = DURATION_PART.findall(str(value or ""))
+    return sum(float(number) * units[unit] for number, unit in parts) if parts else None
+
+
+def is_retryable(error) -> bool:
+    if isinstance(error, (groq.APIConnectionError, TimeoutError, ConnectionError)):
+        return True
+    return error_status(error) in RETRYABLE_STATUS
+
+
+def retry_after(error):
+    # how long the provider asked us to wait: retry-after, else the reset of whichever quota ran out
+    headers = error_headers(error)
+    delay = parse_duration(headers.get("retry-after"))
+    if delay is not None:
+        return delay
+    resets = []
+    for kind in ("requests", "tokens"):
+        remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+        reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+        if reset is not None and (remaining is None or str(remaining) == "0"):
+            resets.append(reset)
+    return max(resets) if resets else None
+
+
+def backoff_delay(attempt: int, base: float = BACKOFF_BASE, cap: float = BACKOFF_CAP) -> float:
+    # full jitter, so workers that failed together do not come back together
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class GroqBackend:
+    name = "groq"
+
+    def complete(self, model: str, sys_prompt: str, content: str, response_model: Type[BaseModel]):
+        output, completion = get_client().chat.completions.create_with_completion(
+            model=model,
+            messages=[
+                {"role": "system", "content": sys_prompt},
+                {"role": "user", "content": content},
+            ],
+            response_model=response_model,
+        )
+        usage = getattr(completion, "usage", None)
+        if usage is not None:
+            LLM_TOKENS.inc(usage.prompt_tokens or 0, model=model, kind="prompt")
+            LLM_TOKENS.inc(usage.completion_tokens or 0, model=model, kind="completion")
+        return output
+
+
+def _field_bounds(field):
+    low, high = None, None
+    for constraint in field.metadata:
+        low = getattr(constraint, "ge", low)
+        high = getattr(constraint, "le", high)
+    return low, high
+
+
+def fake_value(annotation, rng: random.Random, field=None):
+    origin, args = typing.get_origin(annotation), typing.get_args(annotation)
+    if origin is typing.Union:
+        return fake_value(next(arg for arg in args if arg is not type(None)), rng, field)
+    if origin in (list, List):
+        return [fake_value(args[0] if args else str, rng) for _ in range(rng.randint(1, 3))]
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return fake_instance(annotation, rng)
+    if annotation is int:
+        low, high = _field_bounds(field) if field is not None else (None, None)
+        return rng.randint(low if low is not None else 0, high if high is not None else 100)
+    if annotation is float:
+        return rng.random()
+    if annotation is bool:
+        return rng.random() < 0.5
+    return f"synthetic text {rng.randrange(1 << 32):08x}"
+
+
+def fake_instance(model: Type[BaseModel], rng: random.Random):
+    return model(**{name: fake_value(field.annotation, rng, field) for name, field in model.model_fields.items()})
+
+
+class FakeBackend:
+    # in-process stand-in for load tests: answers are schema-valid and a pure function of the input,
+    # failures and 429s are drawn from the same seeded stream so a run can be replayed exactly
+    name = "fake"
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.0, error_rate: float = 0.0, rate_limit_rate: float = 0.0,
+                 retry_after: float = 1.0, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def complete(self, model: str, sys_prompt: str, content: str, response_model: Type[BaseModel]):
+        with self.lock:
+            self.calls += 1
+            call = self.calls
+        rng = random.Random(f"{self.seed}:{call}:{sha256(content)}")
+        time.sleep(max(0.0, self.latency + rng.uniform(-self.jitter, self.jitter)))
+        draw = rng.random()
+        if draw < self.rate_limit_rate:
+            raise BackendError("Rate limit reached (fake)", 429, {"retry-after": str(self.retry_after)})
+        if draw < self.rate_limit_rate + self.error_rate:
+            raise BackendError("Internal server error (fake)", 500)
+        # the answer depends only on the request, so reruns and cache comparisons stay stable
+        output = fake_instance(response_model, random.Random(f"{self.seed}:{model}:{sha256(sys_prompt + content)}"))
+        LLM_TOKENS.inc(estimate_tokens(sys_prompt + content), model=model, kind="prompt")
+        LLM_TOKENS.inc(estimate_tokens(output.model_dump_json()), model=model, kind="completion")
+        return output
+
+
+def backend_from_env():
+    if os.getenv("LLM_BACKEND", "groq") == "fake":
+        return FakeBackend(
+            latency=float(os.getenv("FAKE_LLM_LATENCY", "0.05")),
+            jitter=float(os.getenv("FAKE_LLM_JITTER", "0")),
+            error_rate=float(os.getenv("FAKE_LLM_ERROR_RATE", "0")),
+            rate_limit_rate=float(os.getenv("FAKE_LLM_429_RATE", "0")),
+            seed=int(os.getenv("FAKE_LLM_SEED", "0")),
+        )
+    return GroqBackend()
+
+
+def get_backend():
+    # LLM_BACKEND=fake swaps the whole process onto FakeBackend, e.g. to run the API offline
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = backend_from_env()
+        return _backend
@@ -0,0 +1,159 @@
+import math
+import time
+import threading
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+_timings_lock = threading.Lock()
+
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, key, extra=None):
+    pairs = list(zip(labelnames, key))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, key, None, value) for key, value in self.values.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self.lock:
+            self.values[key] = value
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def observe(self, value: float, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key] = (counts, total + value)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, (counts, total) in self.values.items():
+                for bound, count in zip(self.buckets, counts):
+                    samples.append((f"{self.name}_bucket", key, ("le", _format_value(bound)), count))
+                samples.append((f"{self.name}_sum", key, None, total))
+                samples.append((f"{self.name}_count", key, None, counts[-1]))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def _register(self, metric):
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        # Prometheus text exposition format 0.0.4
+        lines = []
+        with self.lock:
+            metrics = list(self.metrics.values())
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, key, extra, value in metric.samples():
+                lines.append(f"{name}{_format_labels(metric.labelnames, key, extra)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram("gosail_stage_seconds", "Time spent in each pipeline stage", ["stage"])
+STAGE_ITEMS = REGISTRY.counter("gosail_stage_items_total", "Items processed by each pipeline stage", ["stage"])
+FILES_FILTERED = REGISTRY.counter("gosail_files_filtered_total", "Files seen by the filter, by outcome", ["result"])
+CHUNKS_ANALYZED = REGISTRY.counter("gosail_chunks_analyzed_total", "Chunk results by mode and where they came from", ["mode", "source"])
+LLM_REQUESTS = REGISTRY.counter("gosail_llm_requests_total", "LLM requests by model and outcome", ["model", "outcome"])
+LLM_LATENCY = REGISTRY.histogram("gosail_llm_request_seconds", "LLM request latency", ["model"])
+LLM_TOKENS = REGISTRY.counter("gosail_llm_tokens_total", "LLM tokens by model and kind (prompt or completion)", ["model", "kind"])
+LLM_RETRIES = REGISTRY.counter("gosail_llm_retries_total", "LLM requests retried", ["model"])
+LLM_CONCURRENCY = REGISTRY.gauge("gosail_llm_concurrency_limit", "Current adaptive limit on concurrent LLM calls")
+JOBS_BY_STATUS = REGISTRY.gauge("gosail_jobs", "Jobs currently known, by kind and status", ["kind", "status"])
+
+
+def add_timing(timings: dict, stage: str, seconds: float):
+    if timings is None:
+        return
+    with _timings_lock:
+        entry = timings.setdefault(stage, {"seconds": 0.0, "count": 0})
+        entry["seconds"] = round(entry["seconds"] + seconds, 6)
+        entry["count"] += 1
+
+
+@contextmanager
+def timed(stage: str, timings: dict = None):
+    # observes the stage histogram and, when given a per-job timings dict, adds to its breakdown
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        add_timing(timings, stage, elapsed)
@@ -0,0 +1,178 @@
+import os
+import re
+import json
+import time
+import shutil
+import logging
+import threading
+from urllib.parse import quote, urlsplit
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import pygit2
+
+MIRROR_DIR = ".mirrors"
+USAGE_FILE = "usage.json"
+DEFAULT_QUOTA_BYTES = int(os.getenv("MIRROR_QUOTA_BYTES", 20 * 1024 ** 3))
+FETCH_WORKERS = 8
+SCP_URL = re.compile(r"^(?:[^@/]+@)?([^:/]+):(.+)$")
+
+
+def normalize_url(url: str) -> str:
+    # https://GitHub.com/Owner/Repo.git/, git@github.com:owner/repo and ssh://git@github.com/owner/repo
+    # all become github.com/owner/repo
+    url = url.strip().rstrip("/")
+    if "://" in url:
+        parts = urlsplit(url)
+        host, path = (parts.hostname or "").lower(), parts.path
+    else:
+        match = SCP_URL.match(url)
+        host, path = (match.group(1).lower(), match.group(2)) if match else ("", url)
+    path = path.strip("/")
+    if path.endswith(".git"):
+        path = path[:-4]
+    if host in ("github.com", "gitlab.com", "bitbucket.org"):
+        # these hosts treat owner and repo names case-insensitively
+        path = path.lower()
+    return f"{host}/{path}" if host else os.path.abspath(path)
+
+
+def directory_size(path: str) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class MirrorCache:
+    # bare mirrors under <base_path>/.mirrors, one per normalized URL; working copies are cloned from them
+    # locally, so re-evaluating a repo costs one incremental fetch. Mirrors and their working copies are
+    # evicted least recently used first once together they exceed quota_bytes
+    def __init__(self, base_path: str, quota_bytes: int = DEFAULT_QUOTA_BYTES, workers: int = FETCH_WORKERS):
+        self.logger = logging.getLogger(__name__)
+        self.root = os.path.join(base_path, MIRROR_DIR)
+        self.quota_bytes = quota_bytes
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self.repo_locks = {}
+        self.pending = {}
+        self.in_use = {}
+        os.makedirs(self.root, exist_ok=True)
+        self.usage = self._load_usage()
+
+    def _load_usage(self):
+        path = os.path.join(self.root, USAGE_FILE)
+        if not os.path.exists(path):
+            return {}
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def _save_usage(self):
+        path = os.path.join(self.root, USAGE_FILE)
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.usage, f, indent=2)
+        os.replace(path + ".tmp", path)
+
+    def mirror_path(self, url: str) -> str:
+        return os.path.join(self.root, quote(normalize_url(url), safe=""))
+
+    def repo_lock(self, url: str) -> threading.RLock:
+        key = normalize_url(url)
+        with self.lock:
+            return self.repo_locks.setdefault(key, threading.RLock())
+
+    @contextmanager
+    def using(self, url: str):
+        # keeps a repo out of eviction while it is being worked on
+        key = normalize_url(url)
+        with self.lock:
+            self.in_use[key] = self.in_use.get(key, 0) + 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.in_use[key] -= 1
+                if not self.in_use[key]:
+                    del self.in_use[key]
+
+    def _update(self, url: str) -> str:
+        path = self.mirror_path(url)
+        with self.repo_lock(url):
+            if os.path.isdir(path):
+                self.logger.info(f"Fetching mirror of {url}")
+                pygit2.Repository(path).remotes["origin"].fetch()
+            else:
+                self.logger.info(f"Mirroring {url} to {path}")
+                shutil.rmtree(path + ".tmp", ignore_errors=True)
+                pygit2.clone_repository(
+                    url, path + ".tmp", bare=True,
+                    remote=lambda repo, name, remote_url: repo.remotes.create(name, remote_url, "+refs/*:refs/*"),
+                )
+                os.replace(path + ".tmp", path)
+        return path
+
+    def prefetch(self, url: str):
+        # starts the clone or fetch in the pool; concurrent requests for one URL share a single fetch
+        key = normalize_url(url)
+        with self.lock:
+            future = self.pending.get(key)
+            if future is None:
+                future = self.pending[key] = self.executor.submit(self._update, url)
+                future.add_done_callback(lambda _: self._forget_pending(key, future))
+        return future
+
+    def _forget_pending(self, key, future):
+        with self.lock:
+            if self.pending.get(key) is future:
+                del self.pending[key]
+
+    def ensure(self, url: str) -> str:
+        return self.prefetch(url).result()
+
+    def prefetch_all(self, urls):
+        return {url: self.prefetch(url) for url in urls}
+
+    def touch(self, url: str, workdir: str = None):
+        key = normalize_url(url)
+        size = directory_size(self.mirror_path(url)) + (directory_size(workdir) if workdir else 0)
+        with self.lock:
+            entry = self.usage.setdefault(key, {"url": url})
+            entry["last_used"] = time.time()
+            entry["bytes"] = size
+            if workdir:
+                entry["workdir"] = workdir
+            self._save_usage()
+        self.evict()
+
+    def evict(self):
+        with self.lock:
+            total = sum(entry.get("bytes", 0) for entry in self.usage.values())
+            candidates = sorted(
+                (key for key in self.usage if key not in self.in_use and key not in self.pending),
+                key=lambda key: self.usage[key].get("last_used", 0),
+            )
+            chosen = []
+            for key in candidates:
+                if total <= self.quota_bytes:
+                    break
+                total -= self.usage[key].get("bytes", 0)
+                chosen.append((key, dict(self.usage[key])))
+        evicted = []
+        for key, entry in chosen:
+            with self.repo_lock(entry["url"]):
+                # a repo picked up again since keeps its usage record, only what is removed leaves the books
+                with self.lock:
+                    if key in self.in_use or key in self.pending or key not in self.usage:
+                        continue
+                self.logger.info(f"Evicting {entry['url']} ({entry.get('bytes', 0)} bytes)")
+                shutil.rmtree(self.mirror_path(entry["url"]), ignore_errors=True)
+                if entry.get("workdir"):
+                    shutil.rmtree(entry["workdir"], ignore_errors=True)
+                with self.lock:
+                    self.usage.pop(key, None)
+                    self._save_usage()
+            evicted.append(entry["url"])
+        return evicted
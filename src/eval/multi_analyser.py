@@ -0,0 +1,146 @@
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pydantic import create_model
+from .chunk_store import Chunk
+from .code_analyser import CodeAnalyser, ANALYSIS_MODES, CONCURRENCY_HEADROOM, GROQ_MODEL, GROQ_RPM, GROQ_TPM, MAPPING_FILE, RETRY_ROUNDS, save_mapping
+from .llm_backend import backoff_delay
+from .metrics import timed
+from .rate_limiter import AdaptiveConcurrency, RateLimiter
+from .result_cache import ResultCache
+from .result_store import ResultStore
+
+combined_prompt_header = """
+You will perform several independent reviews of the same code in a single response. Each section below
+describes one review. Return one object with exactly one field per review, named after the section, and
+fill each field in exactly as its section asks.
+"""
+
+
+def combined_prompt(analysers):
+    sections = [f"# Review `{mode}`\n{analyser.sys_prompt.strip()}" for mode, analyser in analysers.items()]
+    return combined_prompt_header + "\n\n".join(sections)
+
+
+def combined_model(analysers):
+    return create_model("CombinedAnalysisModel", **{mode: (analyser.response_model, ...) for mode, analyser in analysers.items()})
+
+
+class MultiModeAnalyser:
+    # reads each chunk once and runs every requested mode on it, writing to output_data/<mode>/
+    def __init__(self, analysis_modes, combined: bool = False, max_workers: int = 1, rpm: int = GROQ_RPM, tpm: int = GROQ_TPM,
+                 cache: ResultCache = None, progress=None, cancel_event=None, backend=None, timings=None, compact: bool = False,
+                 result_store: ResultStore = None):
+        self.logger = logging.getLogger(__name__)
+        self.modes = list(dict.fromkeys(analysis_modes))
+        unknown = [mode for mode in self.modes if mode not in ANALYSIS_MODES]
+        if unknown or not self.modes:
+            raise ValueError(f"Unknown analysis modes {unknown}, choose from: {', '.join(ANALYSIS_MODES)}")
+        self.combined = combined and len(self.modes) > 1
+        self.max_workers = max_workers
+        self.cache = cache
+        self.progress = progress
+        self.cancel_event = cancel_event
+        self.timings = timings
+        self.rate_limiter = RateLimiter(rpm, tpm)
+        self.concurrency = AdaptiveConcurrency(max_workers, maximum=max_workers * CONCURRENCY_HEADROOM)
+        self.analysers = {
+            mode: CodeAnalyser(
+                mode, cache=cache, cancel_event=cancel_event, rate_limiter=self.rate_limiter, backend=backend, timings=timings,
+                concurrency=self.concurrency, compact=compact, result_store=result_store,
+                output_dir=os.path.join("output_data", mode), mapping_file=os.path.join("output_data", mode, MAPPING_FILE),
+            )
+            for mode in self.modes
+        }
+        self.combined_prompt = combined_prompt(self.analysers)
+        self.combined_model = combined_model(self.analysers)
+
+    def cancelled(self):
+        return self.cancel_event is not None and self.cancel_event.is_set()
+
+    def process_repo(self, repo_path):
+        first = self.analysers[self.modes[0]]
+        chunks = first.load_chunks(repo_path)
+        folders = {}
+        for mode, analyser in self.analysers.items():
+            folders[mode] = os.path.join(repo_path, analyser.output_dir)
+            os.makedirs(folders[mode], exist_ok=True)
+        # every mode keeps its own retry queue; chunks that failed in an earlier run go first in line
+        queued = {mode: analyser.load_retry_queue(repo_path) for mode, analyser in self.analysers.items()}
+        first_in_line = {chunk_id for chunk_ids in queued.values() for chunk_id in chunk_ids}
+        chunks.sort(key=lambda chunk: chunk.id not in first_in_line)
+
+        mappings = {mode: {} for mode in self.modes}
+        with timed("analyze", self.timings):
+            failed = self.run_chunks([(chunk, self.modes) for chunk in chunks], folders, mappings, "analyze")
+            for retry_round in range(RETRY_ROUNDS):
+                if not failed or self.cancelled():
+                    break
+                time.sleep(backoff_delay(retry_round + 1))
+                self.logger.info(f"Retrying {len(failed)} failed chunks, round {retry_round + 1} of {RETRY_ROUNDS}")
+                failed = self.run_chunks(failed, folders, mappings, "retry")
+
+        chunk_ids = {chunk.id for chunk in chunks}
+        for mode, analyser in self.analysers.items():
+            # a cancelled run did not really try its remaining chunks, so only successes leave the queue;
+            # ids no longer in the chunk store leave it too
+            remaining = {chunk_id for chunk_id in queued[mode] if chunk_id in chunk_ids}
+            if not self.cancelled():
+                remaining |= {chunk.id for chunk, modes in failed if mode in modes}
+            analyser.save_retry_queue(repo_path, sorted(chunk_id for chunk_id in remaining if chunk_id not in mappings[mode]))
+            save_mapping(repo_path, mappings[mode], analyser.mapping_file)
+            analyser.index_results(repo_path, mappings[mode])
+            if not self.cancelled():
+                analyser.final_scores(repo_path)
+
+    def run_chunks(self, tasks, folders, mappings, stage):
+        # tasks: [(chunk, modes to run)]; returns the same for whatever failed. A chunk only goes out as one
+        # combined request while every mode is still due, a retry of some modes uses their own prompts
+        failed = {}
+        with ThreadPoolExecutor(max_workers=self.concurrency.maximum) as executor:
+            futures = {}
+            for chunk, modes in tasks:
+                if self.combined and len(modes) == len(self.modes):
+                    futures[executor.submit(self.process_chunk_combined, chunk, folders)] = chunk
+                else:
+                    # a chunk's requests for every mode are queued next to each other
+                    for mode in modes:
+                        futures[executor.submit(self.process_chunk_single, mode, chunk, folders[mode])] = chunk
+            for done, future in enumerate(as_completed(futures), 1):
+                chunk = futures[future]
+                for mode, output_file_path in future.result().items():
+                    if output_file_path is not None:
+                        mappings[mode][chunk.id] = output_file_path
+                    else:
+                        failed.setdefault(chunk.id, (chunk, []))[1].append(mode)
+                if self.progress is not None:
+                    self.progress(stage, done, len(futures))
+        return list(failed.values())
+
+    def process_chunk_single(self, mode, chunk: Chunk, output_folder):
+        return {mode: self.analysers[mode].process_chunk(chunk, output_folder)}
+
+    def process_chunk_combined(self, chunk: Chunk, folders):
+        if self.cancelled():
+            return {}
+        self.logger.info(f"Processing chunk: {chunk.id} ({', '.join(self.modes)})")
+        # combined answers are cached under the combined prompt, they are not interchangeable with single-mode ones
+        keys = {mode: ResultCache.make_key(chunk.text, mode, GROQ_MODEL, self.combined_prompt) for mode in self.modes}
+        outputs = {mode: self.cache.get(key) for mode, key in keys.items()} if self.cache is not None else {}
+        try:
+            if len(outputs) < len(self.modes) or None in outputs.values():
+                first = self.analysers[self.modes[0]]
+                combined = first.get_output(chunk.payload, self.combined_prompt, self.combined_model,
+                                           sum(analyser.completion_tokens for analyser in self.analysers.values()))
+                outputs = {mode: getattr(combined, mode).model_dump_json(indent=2) for mode in self.modes}
+                if self.cache is not None:
+                    for mode, output in outputs.items():
+                        self.cache.put(keys[mode], output)
+            return {
+                mode: self.analysers[mode].store_output(chunk, output, folders[mode], fresh=False, source="combined")
+                for mode, output in outputs.items()
+            }
+        except Exception as e:
+            self.logger.error(f"Error processing chunk {chunk.id}: {str(e)}")
+            return {mode: None for mode in self.modes}
@@ -0,0 +1,177 @@
+import os
+import json
+import logging
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from .chunk_store import ChunkStore
+from .chunker import CHUNK_WORKERS
+from .code_analyser import CONCURRENCY_HEADROOM, GROQ_RPM, GROQ_TPM, MAX_CONCURRENCY
+from .git_handler import GitHandler
+from .pipeline import init_repository, analyze_repository
+from .rate_limiter import FairConcurrency, RateLimiter
+from .score_aggregator import leaderboard
+
+INIT_WORKERS = 4
+# every analysis runs its own pool of up to the shared pool's maximum threads, so only a few run at a time
+MAX_ANALYSES = 4
+ROUND_ROBIN = "round_robin"
+WEIGHTED = "weighted"
+SCHEDULING = (ROUND_ROBIN, WEIGHTED)
+
+
+class RepoRun:
+    def __init__(self, url: str, repo_path: str):
+        self.url = url
+        self.repo_path = repo_path
+        self.status = "queued"
+        self.progress = {"stage": None, "done": 0, "total": 0}
+        self.chunks = None
+        self.error = None
+        self.summary = None
+
+    def update_progress(self, stage: str, done: int, total: int):
+        self.progress = {"stage": stage, "done": done, "total": total}
+
+    def to_dict(self):
+        return {
+            "repo": self.repo_path,
+            "status": self.status,
+            "progress": self.progress,
+            "chunks": self.chunks,
+            "error": self.error,
+        }
+
+
+class MultiRepoEvaluator:
+    # clones and chunks a few repos at a time and starts analysing each one as soon as it is chunked;
+    # every analysis shares one RPM/TPM budget and one concurrency pool, split fairly between repos
+    def __init__(self, urls, analysis_mode: str, base_path: str, scheduling: str = ROUND_ROBIN, checkout: bool = True,
+                 rpm: int = GROQ_RPM, tpm: int = GROQ_TPM, max_workers: int = MAX_CONCURRENCY, init_workers: int = INIT_WORKERS,
+                 max_analyses: int = MAX_ANALYSES, cancel_event=None, on_progress=None, mirrors=None, repo_lock=None, **analyser_kwargs):
+        # repo_lock(repo_path) -> a lock shared with whatever else writes to that repo, JobManager.repo_lock in the API
+        if scheduling not in SCHEDULING:
+            raise ValueError(f"Unknown scheduling {scheduling}, choose from: {', '.join(SCHEDULING)}")
+        self.logger = logging.getLogger(__name__)
+        self.analysis_mode = analysis_mode
+        self.base_path = base_path
+        self.scheduling = scheduling
+        self.checkout = checkout
+        self.max_workers = max_workers
+        self.init_workers = init_workers
+        self.max_analyses = max_analyses
+        self.cancel_event = cancel_event
+        self.on_progress = on_progress
+        self.mirrors = mirrors
+        self.repo_lock = repo_lock
+        self.analyser_kwargs = analyser_kwargs
+        self.rate_limiter = RateLimiter(rpm, tpm)
+        self.pool = FairConcurrency(max_workers, maximum=max_workers * CONCURRENCY_HEADROOM)
+        self.lock = threading.Lock()
+        self.runs = {}
+        git_handler = GitHandler(base_path)
+        paths = {}
+        for url in dict.fromkeys(urls):
+            run = self.runs[url] = RepoRun(url, git_handler.repo_path(url))
+            # the local path follows the normalized URL, so this is the same repo spelled another way
+            if run.repo_path in paths:
+                run.status = "failed"
+                run.error = f"Same repository as {paths[run.repo_path]}"
+            paths.setdefault(run.repo_path, url)
+
+    def cancelled(self):
+        return self.cancel_event is not None and self.cancel_event.is_set()
+
+    def report_progress(self):
+        if self.on_progress is not None:
+            with self.lock:
+                self.on_progress({url: run.to_dict() for url, run in self.runs.items()})
+
+    def progress_for(self, run: RepoRun):
+        def progress(stage, done, total):
+            run.update_progress(stage, done, total)
+            self.report_progress()
+        return progress
+
+    def locked(self, run: RepoRun):
+        return self.repo_lock(run.repo_path) if self.repo_lock is not None else nullcontext()
+
+    def init_repo(self, run: RepoRun, workers: int):
+        with self.locked(run):
+            self._init_repo(run, workers)
+
+    def _init_repo(self, run: RepoRun, workers: int):
+        run.status = "initializing"
+        self.report_progress()
+        init_repository(run.url, self.base_path, workers=workers, checkout=self.checkout, progress=self.progress_for(run),
+                        cancel_event=self.cancel_event, timings=self.analyser_kwargs.get("timings"), mirrors=self.mirrors)
+        store = ChunkStore(os.path.join(run.repo_path, "chunk_data"))
+        run.chunks = len(store)
+        store.close()
+
+    def analyze_repo(self, run: RepoRun):
+        # the working copy must not be evicted while the analysis writes to it
+        with self.locked(run), self.mirrors.using(run.url) if self.mirrors is not None else nullcontext():
+            self._analyze_repo(run)
+
+    def _analyze_repo(self, run: RepoRun):
+        # weighted scheduling gives big repos a proportionally bigger share, so repos tend to finish together
+        weight = max(run.chunks or 1, 1) if self.scheduling == WEIGHTED else 1
+        self.pool.register(run.repo_path, weight)
+        run.status = "analyzing"
+        self.report_progress()
+        try:
+            analyze_repository(
+                run.repo_path, self.analysis_mode, max_workers=self.max_workers, rate_limiter=self.rate_limiter,
+                concurrency=self.pool.share(run.repo_path), progress=self.progress_for(run), cancel_event=self.cancel_event,
+                **self.analyser_kwargs,
+            )
+        finally:
+            self.pool.unregister(run.repo_path)
+        summary_path = os.path.join(run.repo_path, "output_data", "scores_summary.json")
+        if os.path.exists(summary_path):
+            with open(summary_path, "r") as f:
+                run.summary = json.load(f)
+        run.status = "cancelled" if self.cancelled() else "succeeded"
+
+    def finish(self, run: RepoRun, future):
+        try:
+            future.result()
+        except Exception as e:
+            self.logger.error(f"Batch evaluation of {run.url} failed: {str(e)}", exc_info=True)
+            run.status = "failed"
+            run.error = str(e)
+        self.report_progress()
+
+    def run(self):
+        runs = [run for run in self.runs.values() if run.status == "queued"]
+        # the chunking processes are split between the repos being initialized at the same time
+        chunk_workers = max(1, CHUNK_WORKERS // self.init_workers)
+        if self.mirrors is not None:
+            # fetching is network bound, so every mirror starts updating now instead of waiting for an init slot
+            self.mirrors.prefetch_all(run.url for run in runs)
+        with ThreadPoolExecutor(max_workers=self.init_workers) as init_pool, \
+                ThreadPoolExecutor(max_workers=self.max_analyses) as analysis_pool:
+            inits = {init_pool.submit(self.init_repo, run, chunk_workers): run for run in runs}
+            analyses = {}
+            for future in as_completed(inits):
+                run = inits[future]
+                self.finish(run, future)
+                if run.status == "failed":
+                    continue
+                if self.cancelled():
+                    run.status = "cancelled"
+                    continue
+                analyses[analysis_pool.submit(self.analyze_repo, run)] = run
+            for future in as_completed(analyses):
+                self.finish(analyses[future], future)
+        return self.result()
+
+    def result(self):
+        summaries = {url: run.summary for url, run in self.runs.items()}
+        return {
+            "analysis_type": self.analysis_mode,
+            "scheduling": self.scheduling,
+            "repos": {url: run.to_dict() for url, run in self.runs.items()},
+            "leaderboard": leaderboard(summaries),
+        }
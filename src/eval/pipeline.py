@@ -0,0 +1,108 @@
+import os
+import logging
+from contextlib import nullcontext
+from pathlib import Path
+import pygit2
+from .git_handler import GitHandler
+from .chunker import ChunkExtractor, CHUNK_WORKERS
+from .batch_analyser import BatchCodeAnalyser
+from .code_analyser import CodeAnalyser
+from .hierarchical_analyser import HierarchicalAnalyser
+from .sampling_analyser import SamplingAnalyser, CI_WIDTH
+from .metrics import timed
+from .multi_analyser import MultiModeAnalyser
+from .repo_state import RepoState
+
+logger = logging.getLogger(__name__)
+
+
+def init_repository(url: str, base_path: str, workers: int = CHUNK_WORKERS, checkout: bool = True, progress=None, cancel_event=None,
+                    timings=None, mirrors=None) -> str:
+    # checkout=False makes a bare clone (depth-1 unless it comes from a mirror) and chunks blobs straight
+    # from the object database
+    # a mirrored repo is kept out of eviction until it is chunked
+    with mirrors.using(url) if mirrors is not None else nullcontext():
+        git_handler = GitHandler(base_path, mirrors)
+        with timed("clone", timings):
+            repo = git_handler.clone_repository(url, bare=not checkout, depth=0 if checkout else 1)
+        repo_path = git_handler.repo_path(url)
+        head = str(git_handler.get_latest_commit(repo).id)
+
+        state = RepoState(repo_path)
+        chunk_extractor = ChunkExtractor(progress=progress, cancel_event=cancel_event, timings=timings)
+        diff = None
+        if checkout and state.chunked_commit and os.path.isdir(os.path.join(repo_path, "chunk_data")):
+            diff = git_handler.changed_files(repo, state.chunked_commit, head)
+
+        if not checkout:
+            # unchanged blob ids are skipped, so this is incremental on its own
+            chunk_extractor.processBlobs(Path(repo_path), repo, workers)
+        elif diff is None:
+            chunk_extractor.processRepo(Path(repo_path), workers)
+        else:
+            changed, removed = diff
+            logger.info(f"Incremental chunking: {len(changed)} changed, {len(removed)} removed files")
+            # modified files may produce fewer chunks than before, so drop their old ones too
+            chunk_extractor.removeFiles(Path(repo_path), changed + removed)
+            chunk_extractor.processFiles(Path(repo_path), changed, workers)
+
+        # a cancelled run leaves a partial chunk store, so force a full run next time
+        state.chunked_commit = None if chunk_extractor.cancelled() else head
+        state.save()
+        if mirrors is not None:
+            mirrors.touch(url, repo_path)
+    return repo_path
+
+
+def analyze_repository(repo_path: str, analysis_mode: str, batch_tokens: int = None, max_calls: int = None, ci_width: float = None,
+                       sample_calls: int = None, **analyser_kwargs) -> CodeAnalyser:
+    # batch_tokens packs small chunks into shared requests of up to that many input tokens;
+    # max_calls switches to one hierarchical repo-level evaluation made in at most that many requests;
+    # ci_width or sample_calls estimates the scores from a stratified sample until the intervals are that
+    # narrow or that many requests were made
+    if not os.path.isdir(os.path.join(repo_path, "chunk_data")):
+        raise FileNotFoundError(f"Repository not initialized: {repo_path}")
+    state = RepoState(repo_path)
+    code_analyser = None
+    if max_calls:
+        code_analyser = HierarchicalAnalyser(analysis_mode, max_calls=max_calls, **analyser_kwargs)
+    elif ci_width or sample_calls:
+        code_analyser = SamplingAnalyser(analysis_mode, ci_width=ci_width or CI_WIDTH, max_calls=sample_calls, **analyser_kwargs)
+    if code_analyser is not None:
+        code_analyser.process_repo(repo_path)
+        if not code_analyser.cancelled():
+            # output_data no longer holds every chunk's result, so the next per-chunk run starts from scratch
+            state.analyzed_commit = None
+            state.analyzed_mode = analysis_mode
+            state.save()
+        return code_analyser
+    if batch_tokens:
+        code_analyser = BatchCodeAnalyser(analysis_mode, batch_tokens=batch_tokens, **analyser_kwargs)
+    else:
+        code_analyser = CodeAnalyser(analysis_mode, **analyser_kwargs)
+
+    files = None
+    if state.analyzed_mode == analysis_mode and state.analyzed_commit and state.chunked_commit:
+        diff = GitHandler().changed_files(pygit2.Repository(repo_path), state.analyzed_commit, state.chunked_commit)
+        if diff is not None:
+            changed, removed = diff
+            logger.info(f"Incremental analysis: {len(changed)} changed, {len(removed)} removed files")
+            code_analyser.remove_outputs(repo_path, changed + removed)
+            files = changed
+
+    code_analyser.process_repo(repo_path, files=files)
+    if code_analyser.cancelled():
+        return code_analyser
+
+    state.analyzed_commit = state.chunked_commit
+    state.analyzed_mode = analysis_mode
+    state.save()
+    return code_analyser
+
+
+def analyze_repository_modes(repo_path: str, analysis_modes, combined: bool = False, **analyser_kwargs) -> MultiModeAnalyser:
+    if not os.path.isdir(os.path.join(repo_path, "chunk_data")):
+        raise FileNotFoundError(f"Repository not initialized: {repo_path}")
+    multi_analyser = MultiModeAnalyser(analysis_modes, combined=combined, **analyser_kwargs)
+    multi_analyser.process_repo(repo_path)
+    return multi_analyser
@@ -0,0 +1,171 @@
+import time
+import threading
+from collections import deque
+
+WINDOW_SECONDS = 60
+
+
+def estimate_tokens(text: str) -> int:
+    # rough heuristic, close enough for pacing against a per-minute budget
+    return max(1, len(text) // 4)
+
+
+class RateLimiter:
+    def __init__(self, rpm: int = None, tpm: int = None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.lock = threading.Lock()
+        self.requests = deque()
+        self.tokens = deque()
+        self.token_total = 0
+
+    def _expire(self, now):
+        while self.requests and now - self.requests[0] >= WINDOW_SECONDS:
+            self.requests.popleft()
+        while self.tokens and now - self.tokens[0][0] >= WINDOW_SECONDS:
+            self.token_total -= self.tokens.popleft()[1]
+
+    def _wait_time(self, now, tokens):
+        wait = 0
+        if self.rpm and len(self.requests) >= self.rpm:
+            wait = max(wait, self.requests[0] + WINDOW_SECONDS - now)
+        if self.tpm and self.tokens and self.token_total + tokens > self.tpm:
+            # wait until enough of the window has expired to fit this request
+            freed = self.token_total
+            for timestamp, used in self.tokens:
+                freed -= used
+                if freed + tokens <= self.tpm:
+                    wait = max(wait, timestamp + WINDOW_SECONDS - now)
+                    break
+            else:
+                # larger than the whole budget, let it through on an empty window
+                wait = max(wait, self.tokens[-1][0] + WINDOW_SECONDS - now)
+        return wait
+
+    def acquire(self, tokens: int = 0):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._expire(now)
+                wait = self._wait_time(now, tokens)
+                if wait <= 0:
+                    self.requests.append(now)
+                    self.tokens.append((now, tokens))
+                    self.token_total += tokens
+                    return
+            time.sleep(wait)
+
+
+class AdaptiveConcurrency:
+    # AIMD over in-flight calls: one more slot after a full round of successes, half the slots on a 429
+    # (at most once per cooldown, since one burst usually fails several calls at once); a 429 that says
+    # how long to wait pauses every caller until then
+    def __init__(self, initial: int, minimum: int = 1, maximum: int = None, cooldown: float = 5.0):
+        self.minimum = max(1, minimum)
+        self.maximum = max(maximum or initial, self.minimum)
+        self.limit = min(max(initial, self.minimum), self.maximum)
+        self.cooldown = cooldown
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.successes = 0
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    self.condition.wait(self.paused_until - now)
+                elif self.in_flight < self.limit:
+                    self.in_flight += 1
+                    return
+                else:
+                    self.condition.wait()
+
+    def release(self, outcome: str = "ok", pause: float = 0.0):
+        with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if outcome == "rate_limited":
+                self.successes = 0
+                if now - self.last_decrease >= self.cooldown:
+                    self.limit = max(self.minimum, self.limit // 2)
+                    self.last_decrease = now
+                if pause > 0:
+                    self.paused_until = max(self.paused_until, now + pause)
+            elif outcome == "ok":
+                self.successes += 1
+                if self.successes >= self.limit and self.limit < self.maximum:
+                    self.limit += 1
+                    self.successes = 0
+            self.condition.notify_all()
+
+
+class FairConcurrency(AdaptiveConcurrency):
+    # one adaptive pool shared by several repos: a free slot goes to the waiting repo that has had the
+    # least service so far, each call counting 1/weight, so equal weights give round-robin
+    def __init__(self, initial: int, minimum: int = 1, maximum: int = None, cooldown: float = 5.0):
+        super().__init__(initial, minimum, maximum, cooldown)
+        self.weights = {}
+        self.service = {}
+        self.waiting = {}
+
+    def register(self, key, weight: float = 1.0):
+        with self.condition:
+            # late joiners start level with the least served active repo instead of at zero
+            self.service[key] = min(self.service.values(), default=0.0)
+            self.weights[key] = max(weight, 1e-9)
+
+    def unregister(self, key):
+        with self.condition:
+            self.service.pop(key, None)
+            self.weights.pop(key, None)
+            self.condition.notify_all()
+
+    def share(self, key):
+        return FairShare(self, key)
+
+    def acquire(self, key=None):
+        with self.condition:
+            if key not in self.service:
+                self.service[key] = min(self.service.values(), default=0.0)
+                self.weights[key] = 1.0
+            self.waiting[key] = self.waiting.get(key, 0) + 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    if now < self.paused_until:
+                        self.condition.wait(self.paused_until - now)
+                    elif self.in_flight < self.limit and key == min(self.waiting, key=self.service.get):
+                        self.in_flight += 1
+                        self.service[key] += 1 / self.weights[key]
+                        return
+                    else:
+                        self.condition.wait()
+            finally:
+                self.waiting[key] -= 1
+                if not self.waiting[key]:
+                    del self.waiting[key]
+                self.condition.notify_all()
+
+
+class FairShare:
+    # what a single CodeAnalyser sees of a FairConcurrency pool
+    def __init__(self, pool: FairConcurrency, key):
+        self.pool = pool
+        self.key = key
+
+    @property
+    def limit(self):
+        return self.pool.limit
+
+    @property
+    def maximum(self):
+        return self.pool.maximum
+
+    def acquire(self):
+        self.pool.acquire(self.key)
+
+    def release(self, outcome: str = "ok", pause: float = 0.0):
+        self.pool.release(outcome, pause)
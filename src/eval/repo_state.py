@@ -0,0 +1,30 @@
+import os
+import json
+
+STATE_FILE = "analysis_state.json"
+
+
+class RepoState:
+    def __init__(self, repo_path: str):
+        self.path = os.path.join(repo_path, STATE_FILE)
+        self.chunked_commit = None
+        self.analyzed_commit = None
+        self.analyzed_mode = None
+        self.load()
+
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            self.chunked_commit = data.get("chunked_commit")
+            self.analyzed_commit = data.get("analyzed_commit")
+            self.analyzed_mode = data.get("analyzed_mode")
+
+    def save(self):
+        data = {
+            "chunked_commit": self.chunked_commit,
+            "analyzed_commit": self.analyzed_commit,
+            "analyzed_mode": self.analyzed_mode,
+        }
+        with open(self.path, 'w') as f:
+            json.dump(data, f, indent=2)
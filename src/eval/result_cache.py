@@ -0,0 +1,97 @@
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+DEFAULT_CACHE_PATH = "./cache/analysis_cache.sqlite"
+MAX_CACHE_BYTES = 512 * 1024 * 1024
+MAX_CACHE_AGE = 30 * 24 * 3600
+EVICT_EVERY = 100
+
+
+def sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_bytes: int = MAX_CACHE_BYTES, max_age: float = MAX_CACHE_AGE):
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, output TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_results_accessed ON results(accessed)")
+            self.conn.commit()
+
+    @staticmethod
+    def make_key(chunk_text: str, analysis_mode: str, model: str, sys_prompt: str) -> str:
+        return sha256("\0".join([sha256(chunk_text), analysis_mode, model, sha256(sys_prompt)]))
+
+    def get(self, key: str):
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT output, created FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None or (self.max_age and now - row[1] > self.max_age):
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE results SET accessed = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, output: str):
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO results (key, output, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, output, len(output.encode("utf-8")), now, now),
+            )
+            self.conn.commit()
+            self._puts += 1
+            if self._puts % EVICT_EVERY == 0:
+                self._evict()
+
+    def evict(self):
+        with self.lock:
+            self._evict()
+
+    def _evict(self):
+        if self.max_age:
+            self.conn.execute("DELETE FROM results WHERE created < ?", (time.time() - self.max_age,))
+        if self.max_bytes:
+            total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+            if total > self.max_bytes:
+                # drop least recently used entries until we are back under the cap
+                stale = []
+                for key, size in self.conn.execute("SELECT key, size FROM results ORDER BY accessed ASC"):
+                    if total <= self.max_bytes:
+                        break
+                    stale.append((key,))
+                    total -= size
+                self.conn.executemany("DELETE FROM results WHERE key = ?", stale)
+        self.conn.commit()
+
+    def stats(self):
+        with self.lock:
+            entries, size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": size}
+
+    def close(self):
+        with self.lock:
+            self._evict()
+            self.conn.close()
@@ -0,0 +1,166 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import logging
+import threading
+from .chunk_store import chunk_file
+
+DEFAULT_STORE_PATH = "./cache/results.sqlite"
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+DEFAULT_FIELDS = ("chunk_id", "file", "scores")
+COLUMN_FIELDS = ("chunk_id", "file", "directory", "triage", "duplicate_of", "updated")
+SORT_COLUMNS = ("chunk_id", "file", "directory", "updated")
+OPERATORS = {"<": "<", "<=": "<=", ">": ">", ">=": ">=", "=": "=", "==": "=", "!=": "!="}
+SCORE_FILTER = re.compile(r"^\s*(\w+)\s*(<=|>=|==|!=|<|>|=)\s*(-?\d+(?:\.\d+)?)\s*$")
+
+
+class QueryError(ValueError):
+    pass
+
+
+def parse_score_filter(expression: str):
+    # "security<4" -> ("security", "<", 4.0)
+    match = SCORE_FILTER.match(expression)
+    if match is None:
+        raise QueryError(f"Bad score filter {expression!r}, expected e.g. security<4")
+    category, operator, value = match.groups()
+    return category, OPERATORS[operator], float(value)
+
+
+class ResultStore:
+    # per-chunk results of every analysed repo and mode, one row per chunk plus one row per category score,
+    # so filters, sorts and pages are answered from indexes instead of by reading output files
+    def __init__(self, path: str = DEFAULT_STORE_PATH):
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                "repo TEXT NOT NULL, mode TEXT NOT NULL, chunk_id TEXT NOT NULL, file TEXT NOT NULL, directory TEXT NOT NULL, "
+                "triage TEXT, duplicate_of TEXT, output TEXT NOT NULL, updated REAL NOT NULL, "
+                "PRIMARY KEY (repo, mode, chunk_id))"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS scores ("
+                "repo TEXT NOT NULL, mode TEXT NOT NULL, chunk_id TEXT NOT NULL, category TEXT NOT NULL, score REAL NOT NULL, "
+                "PRIMARY KEY (repo, mode, chunk_id, category))"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_file ON chunks(repo, mode, file)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_directory ON chunks(repo, mode, directory)")
+            # one index serves every category: equality on (repo, mode, category), then a range on score
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_scores_category ON scores(repo, mode, category, score)")
+            self.conn.commit()
+
+    def ingest(self, repo: str, mode: str, mapping: dict):
+        # mapping {chunk_id: output file} is the whole current result set of (repo, mode); rows for chunks that
+        # are gone are dropped in the same transaction
+        now = time.time()
+        chunk_rows, score_rows = [], []
+        for chunk_id, output_file_path in mapping.items():
+            if not os.path.exists(output_file_path):
+                continue
+            with open(output_file_path, "r", encoding="utf-8") as f:
+                output = f.read()
+            data = json.loads(output)
+            file = chunk_file(chunk_id)
+            duplicate_of = data.get("duplicate_of", {}).get("chunk") if isinstance(data.get("duplicate_of"), dict) else None
+            triage = data.get("triage") if isinstance(data.get("triage"), str) else None
+            chunk_rows.append((repo, mode, chunk_id, file, os.path.dirname(file) or ".", triage, duplicate_of, output, now))
+            for category, value in data.items():
+                if isinstance(value, dict) and isinstance(value.get("score"), (int, float)):
+                    score_rows.append((repo, mode, chunk_id, category, value["score"]))
+        with self.lock:
+            with self.conn:
+                self.conn.execute("DELETE FROM chunks WHERE repo = ? AND mode = ?", (repo, mode))
+                self.conn.execute("DELETE FROM scores WHERE repo = ? AND mode = ?", (repo, mode))
+                self.conn.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", chunk_rows)
+                self.conn.executemany("INSERT INTO scores VALUES (?, ?, ?, ?, ?)", score_rows)
+        self.logger.info(f"Indexed {len(chunk_rows)} results of {repo} ({mode})")
+
+    def query(self, repo: str, mode: str, path: str = None, chunk_id: str = None, where=(), sort: str = None,
+              limit: int = DEFAULT_LIMIT, offset: int = 0, fields=DEFAULT_FIELDS):
+        # path limits to a file or everything below a directory; where holds "category<op>value" filters that
+        # all have to match; sort is a column or category name, "-" first for descending; fields picks what each
+        # row carries: columns, "scores", "output", or any top-level key of the output
+        limit = max(1, min(limit, MAX_LIMIT))
+        offset = max(0, offset)
+        fields = list(dict.fromkeys(fields or DEFAULT_FIELDS))
+        conditions, params = ["c.repo = ?", "c.mode = ?"], [repo, mode]
+        if path and path.strip("/") not in ("", "."):
+            path = path.strip("/")
+            # a range on file keeps to the index, unlike LIKE 'path/%'
+            conditions.append("(c.file = ? OR (c.file >= ? AND c.file < ?))")
+            params += [path, path + "/", path + "0"]
+        if chunk_id:
+            conditions.append("c.chunk_id = ?")
+            params.append(chunk_id)
+        for expression in where:
+            category, operator, value = parse_score_filter(expression)
+            conditions.append(
+                f"c.chunk_id IN (SELECT chunk_id FROM scores WHERE repo = ? AND mode = ? AND category = ? AND score {operator} ?)"
+            )
+            params += [repo, mode, category, value]
+
+        join, join_params, order = "", [], "c.chunk_id"
+        if sort:
+            descending = sort.startswith("-")
+            key = sort.lstrip("-+")
+            direction = "DESC" if descending else "ASC"
+            if key in SORT_COLUMNS:
+                order = f"c.{key} {direction}, c.chunk_id"
+            else:
+                # chunks without the category sort last either way
+                join = "LEFT JOIN scores s ON s.repo = c.repo AND s.mode = c.mode AND s.chunk_id = c.chunk_id AND s.category = ?"
+                join_params = [key]
+                order = f"s.score IS NULL, s.score {direction}, c.chunk_id"
+
+        needs_output = any(field not in COLUMN_FIELDS and field != "scores" for field in fields)
+        columns = list(COLUMN_FIELDS) + (["output"] if needs_output else [])
+        where_sql = " AND ".join(conditions)
+        with self.lock:
+            total = self.conn.execute(f"SELECT COUNT(*) FROM chunks c WHERE {where_sql}", params).fetchone()[0]
+            rows = self.conn.execute(
+                f"SELECT {', '.join('c.' + column for column in columns)} FROM chunks c {join} WHERE {where_sql} "
+                f"ORDER BY {order} LIMIT ? OFFSET ?",
+                join_params + params + [limit, offset],
+            ).fetchall()
+            scores = {}
+            if "scores" in fields and rows:
+                ids = [row[0] for row in rows]
+                for row_chunk_id, category, score in self.conn.execute(
+                    f"SELECT chunk_id, category, score FROM scores WHERE repo = ? AND mode = ? AND chunk_id IN ({', '.join('?' * len(ids))})",
+                    [repo, mode] + ids,
+                ):
+                    scores.setdefault(row_chunk_id, {})[category] = score
+
+        results = []
+        for row in rows:
+            record = dict(zip(columns, row))
+            output = json.loads(record.pop("output")) if needs_output else None
+            item = {}
+            for field in fields:
+                if field == "scores":
+                    item["scores"] = scores.get(record["chunk_id"], {})
+                elif field in COLUMN_FIELDS:
+                    item[field] = record[field]
+                elif field == "output":
+                    item["output"] = output
+                else:
+                    item[field] = output.get(field)
+            results.append(item)
+        return {"total": total, "limit": limit, "offset": offset, "results": results}
+
+    def count(self, repo: str, mode: str) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM chunks WHERE repo = ? AND mode = ?", (repo, mode)).fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,220 @@
+import os
+import json
+import random
+import threading
+import statistics
+from statistics import NormalDist
+from ..models.code_descriptor_model import CodeDescriptorModel
+from .chunk_store import Chunk
+from .code_analyser import CallBudgetExceeded, CodeAnalyser, GROQ_MODEL, save_mapping
+from .metrics import timed
+from .score_aggregator import chunk_scores, chunk_weight
+
+CI_WIDTH = 1.0
+CONFIDENCE = 0.95
+MIN_SAMPLES = 20
+SIZE_BUCKETS = (50, 200)
+SAMPLE_SEED = 0
+
+
+def size_bucket(lines: int) -> int:
+    for bucket, bound in enumerate(SIZE_BUCKETS):
+        if lines <= bound:
+            return bucket
+    return len(SIZE_BUCKETS)
+
+
+def stratum_key(chunk: Chunk):
+    # language, top-level directory and size class
+    top = chunk.file.split("/", 1)[0] if "/" in chunk.file else "."
+    return chunk.language, top, size_bucket(chunk_weight(chunk.text))
+
+
+def stratified_estimate(strata: dict, samples: dict, sampled: set, z: float):
+    # strata: {key: (chunks, lines)}; samples: {key: [scores]} for one category. A sampled stratum with no scores
+    # does not report the category and drops out, like NaN rows do in the aggregator.
+    # Line-weighted mean over strata with a finite population correction; strata not sampled yet take the
+    # pooled mean and a single-sample variance, which keeps the interval honest until they are
+    pooled = [score for scores in samples.values() for score in scores]
+    if len(pooled) < 2:
+        return None
+    pooled_mean, pooled_variance = statistics.fmean(pooled), statistics.variance(pooled)
+    included = {key: value for key, value in strata.items() if key not in sampled or samples.get(key)}
+    total = sum(lines for _, lines in included.values())
+    mean = variance = 0.0
+    for key, (chunks, lines) in included.items():
+        share = lines / total
+        scores = samples.get(key, [])
+        n = len(scores)
+        stratum_mean = statistics.fmean(scores) if n else pooled_mean
+        stratum_variance = statistics.variance(scores) if n >= 2 else pooled_variance
+        mean += share * stratum_mean
+        variance += share ** 2 * stratum_variance / max(n, 1) * (1 - n / chunks if n else 1)
+    half_width = z * variance ** 0.5
+    return {"mean": round(mean, 2), "ci_low": round(mean - half_width, 2), "ci_high": round(mean + half_width, 2),
+            "width": round(2 * half_width, 3), "samples": len(pooled)}
+
+
+class SamplingAnalyser(CodeAnalyser):
+    # scores a stratified sample instead of every chunk and stops as soon as every category's confidence
+    # interval is narrower than ci_width, or once max_calls LLM requests have been made
+    def __init__(self, analysis_mode: str, ci_width: float = CI_WIDTH, confidence: float = CONFIDENCE, max_calls: int = None,
+                 min_samples: int = MIN_SAMPLES, seed: int = SAMPLE_SEED, **kwargs):
+        super().__init__(analysis_mode, **kwargs)
+        if self.response_model is CodeDescriptorModel:
+            raise ValueError("Descriptions have no scores to estimate")
+        self.ci_width = ci_width
+        self.z = NormalDist().inv_cdf((1 + confidence) / 2)
+        self.confidence = confidence
+        self.max_calls = max_calls
+        self.min_samples = min_samples
+        self.seed = seed
+        self.calls = 0
+        self.calls_lock = threading.Lock()
+        self.estimate = None
+
+    def call_backend(self, code: str, sys_prompt: str, response_model=None, model: str = GROQ_MODEL):
+        # every request counts against max_calls, retries included, and none goes out once they are spent;
+        # the chunk then fails and stays out of the sample
+        with self.calls_lock:
+            if self.max_calls is not None and self.calls >= self.max_calls:
+                raise CallBudgetExceeded(f"All {self.max_calls} calls spent")
+            self.calls += 1
+        return super().call_backend(code, sys_prompt, response_model, model)
+
+    def budget_left(self):
+        return None if self.max_calls is None else self.max_calls - self.calls
+
+    def process_repo(self, repo_path, files=None):
+        # files is ignored: an estimate always covers the whole repo, and a repeat run draws the same sample,
+        # which mostly comes back from the result cache
+        self.calls = 0
+        self.dedup_report = None
+        self.triage_decisions = {}
+        chunks = self.load_chunks(repo_path)
+        rng = random.Random(self.seed)
+        pools, strata = {}, {}
+        for chunk in chunks:
+            key = stratum_key(chunk)
+            pools.setdefault(key, []).append(chunk)
+            count, lines = strata.get(key, (0, 0))
+            strata[key] = (count + 1, lines + chunk_weight(chunk.text))
+        for pool in pools.values():
+            rng.shuffle(pool)
+
+        mapping = {}
+        totals = {key: [] for key in strata}
+        drawn = {key: 0 for key in strata}
+        samples = {}
+        sampled = set()
+        stopped = "exhausted"
+        with timed("analyze", self.timings):
+            while any(pools.values()):
+                if self.cancelled():
+                    stopped = "cancelled"
+                    break
+                budget = self.budget_left()
+                if budget is not None and budget <= 0:
+                    stopped = "budget"
+                    break
+                size = self.concurrency.maximum if budget is None else min(self.concurrency.maximum, budget)
+                batch = self.draw(pools, strata, totals, drawn, size)
+                for chunk, output_file_path in self.iter_repo(repo_path, batch):
+                    if output_file_path is None:
+                        continue
+                    mapping[chunk.id] = output_file_path
+                    with open(output_file_path, "r", encoding="utf-8") as f:
+                        scores = chunk_scores(json.load(f))
+                    key = stratum_key(chunk)
+                    sampled.add(key)
+                    if scores:
+                        totals[key].append(sum(scores.values()) / len(scores))
+                    for category, score in scores.items():
+                        samples.setdefault(category, {}).setdefault(key, []).append(score)
+                if self.progress is not None:
+                    self.progress("sample", len(mapping), len(chunks))
+                if self.converged(strata, samples, sampled, len(mapping)):
+                    stopped = "converged"
+                    break
+
+        self.estimate = self.summarise(strata, samples, sampled, mapping, chunks, stopped)
+        self.logger.info(f"Sampled {len(mapping)} of {len(chunks)} chunks with {self.calls} calls, stopped: {stopped}")
+        save_mapping(repo_path, mapping, self.mapping_file)
+        self.index_results(repo_path, mapping)
+        if stopped != "cancelled":
+            self.final_scores(repo_path)
+
+    def draw(self, pools, strata, totals, drawn, size):
+        # unsampled strata first, largest first; then wherever one more sample shrinks the variance the most
+        total_lines = sum(lines for _, lines in strata.values())
+        pooled = [score for scores in totals.values() for score in scores]
+        pooled_variance = statistics.variance(pooled) if len(pooled) >= 2 else 1.0
+        batch = []
+        while len(batch) < size:
+            candidates = [key for key, pool in pools.items() if pool]
+            if not candidates:
+                break
+
+            def gain(key):
+                n = drawn[key]
+                share = strata[key][1] / total_lines
+                if n == 0:
+                    return float("inf"), share
+                variance = statistics.variance(totals[key]) if len(totals[key]) >= 2 else pooled_variance
+                # drawn rather than scored, so a stratum whose chunks keep failing is not drained first
+                return share ** 2 * max(variance, 1e-6) * (1 / n - 1 / (n + 1)), share
+
+            key = max(candidates, key=gain)
+            batch.append(pools[key].pop())
+            drawn[key] += 1
+        return batch
+
+    def converged(self, strata, samples, sampled: set, count: int):
+        if count < self.min_samples or not samples:
+            return False
+        for category_samples in samples.values():
+            estimate = stratified_estimate(strata, category_samples, sampled, self.z)
+            if estimate is None or estimate["width"] > self.ci_width:
+                return False
+        return True
+
+    def summarise(self, strata, samples, sampled, mapping, chunks, stopped):
+        sampled_lines = sum(chunk_weight(chunk.text) for chunk in chunks if chunk.id in mapping)
+        total_lines = sum(lines for _, lines in strata.values())
+        intervals = {}
+        for category, category_samples in samples.items():
+            estimate = stratified_estimate(strata, category_samples, sampled, self.z)
+            if estimate is not None:
+                intervals[category] = estimate
+        return {
+            "confidence": self.confidence,
+            "target_width": self.ci_width,
+            "stopped": stopped,
+            "calls": self.calls,
+            "max_calls": self.max_calls,
+            "intervals": intervals,
+            "coverage": {
+                "chunks": len(chunks),
+                "sampled": len(mapping),
+                "fraction": round(len(mapping) / len(chunks), 4) if chunks else None,
+                "lines_fraction": round(sampled_lines / total_lines, 4) if total_lines else None,
+                "strata": len(strata),
+                "strata_sampled": len(sampled),
+            },
+        }
+
+    def final_scores(self, repo_path):
+        # the aggregator's statistics and rollups cover the sampled chunks; the headline scores are the estimates
+        super().final_scores(repo_path)
+        output_file = os.path.join(repo_path, self.output_dir, "scores_summary.json")
+        if self.estimate is None or not os.path.exists(output_file):
+            return
+        with open(output_file, "r") as f:
+            summary = json.load(f)
+        intervals = self.estimate["intervals"]
+        if intervals:
+            summary["scores_by_category"] = {category: interval["mean"] for category, interval in intervals.items()}
+            summary["overall"] = round(statistics.fmean(summary["scores_by_category"].values()), 2)
+        summary["estimate"] = self.estimate
+        with open(output_file, "w") as f:
+            json.dump(summary, f, indent=2)
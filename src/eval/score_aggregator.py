@@ -0,0 +1,229 @@
+import json
+import threading
+import numpy as np
+
+PERCENTILES = (10, 25, 50, 75, 90)
+MAX_SCORE = 10
+INITIAL_CAPACITY = 256
+SCORES_STATE_FILE = "scores_state.npz"
+
+
+def chunk_scores(data: dict) -> dict:
+    return {key: value["score"] for key, value in data.items() if isinstance(value, dict) and isinstance(value.get("score"), (int, float))}
+
+
+def chunk_weight(text: str) -> int:
+    return text.count("\n") + 1
+
+
+def weighted_percentiles(values, weights, percentiles=PERCENTILES):
+    order = np.argsort(values)
+    cumulative = np.cumsum(weights[order])
+    # midpoint rule, so a single value is every percentile and equal weights match the usual definition
+    positions = (cumulative - weights[order] / 2) / cumulative[-1]
+    return np.interp(np.asarray(percentiles) / 100, positions, values[order])
+
+
+def ancestors(path: str):
+    parts = path.split("/")[:-1]
+    return ["."] + ["/".join(parts[:depth]) for depth in range(1, len(parts) + 1)]
+
+
+class ScoreAggregator:
+    # one row per chunk, one column per score category; NaN marks a category the chunk did not report.
+    # rows are updated as results arrive, so summaries and rollups never go back to the output files
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.categories = []
+        self.columns = {}
+        self.rows = {}
+        self.files = []
+        self.file_index = {}
+        self.scores = np.full((INITIAL_CAPACITY, 0), np.nan, dtype=np.float32)
+        self.weights = np.zeros(INITIAL_CAPACITY, dtype=np.float32)
+        self.row_files = np.zeros(INITIAL_CAPACITY, dtype=np.int32)
+        self.size = 0
+
+    def _grow(self, rows: int, columns: int):
+        capacity, width = self.scores.shape
+        if rows > capacity or columns > width:
+            new_capacity = max(capacity, INITIAL_CAPACITY)
+            while new_capacity < rows:
+                new_capacity *= 2
+            scores = np.full((new_capacity, max(width, columns)), np.nan, dtype=np.float32)
+            scores[:capacity, :width] = self.scores
+            self.scores = scores
+            self.weights = np.resize(self.weights, new_capacity)
+            self.weights[capacity:] = 0
+            self.row_files = np.resize(self.row_files, new_capacity)
+
+    def add(self, chunk_id: str, file: str, weight: float, scores: dict):
+        with self.lock:
+            for category in scores:
+                if category not in self.columns:
+                    self.columns[category] = len(self.categories)
+                    self.categories.append(category)
+            if file not in self.file_index:
+                self.file_index[file] = len(self.files)
+                self.files.append(file)
+            row = self.rows.get(chunk_id)
+            if row is None:
+                row = self.rows[chunk_id] = self.size
+                self.size += 1
+            self._grow(self.size, len(self.categories))
+            self.scores[row] = np.nan
+            for category, score in scores.items():
+                self.scores[row, self.columns[category]] = score
+            self.weights[row] = weight
+            self.row_files[row] = self.file_index[file]
+
+    def remove(self, chunk_id: str):
+        # the row stays allocated but stops counting anywhere
+        with self.lock:
+            row = self.rows.pop(chunk_id, None)
+            if row is not None:
+                self.scores[row] = np.nan
+                self.weights[row] = 0
+
+    def retain(self, chunk_ids):
+        keep = set(chunk_ids)
+        for chunk_id in [chunk_id for chunk_id in self.rows if chunk_id not in keep]:
+            self.remove(chunk_id)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _snapshot(self):
+        with self.lock:
+            return self.scores[:self.size].copy(), self.weights[:self.size].copy(), self.row_files[:self.size].copy(), list(self.categories), list(self.files)
+
+    def summary(self):
+        scores, weights, _, categories, _ = self._snapshot()
+        result = {}
+        for column, category in enumerate(categories):
+            values = scores[:, column]
+            valid = ~np.isnan(values) & (weights > 0)
+            if not valid.any():
+                continue
+            values, value_weights = values[valid].astype(np.float64), weights[valid].astype(np.float64)
+            result[category] = {
+                "mean": round(float(np.average(values, weights=value_weights)), 2),
+                "unweighted_mean": round(float(values.mean()), 2),
+                "std": round(float(np.sqrt(np.average((values - np.average(values, weights=value_weights)) ** 2, weights=value_weights))), 2),
+                "min": float(values.min()),
+                "max": float(values.max()),
+                "chunks": int(valid.sum()),
+                "percentiles": {f"p{p}": round(float(v), 2) for p, v in zip(PERCENTILES, weighted_percentiles(values, value_weights))},
+                "distribution": np.bincount(np.clip(np.rint(values).astype(np.int64), 0, MAX_SCORE), minlength=MAX_SCORE + 1)[1:].tolist(),
+            }
+        return result
+
+    def _file_sums(self):
+        scores, weights, row_files, categories, files = self._snapshot()
+        valid = ~np.isnan(scores) & (weights[:, None] > 0)
+        weighted = np.where(valid, scores * weights[:, None], 0).astype(np.float64)
+        present = np.where(valid, weights[:, None], 0).astype(np.float64)
+        sums = np.zeros((len(files), len(categories)))
+        totals = np.zeros((len(files), len(categories)))
+        np.add.at(sums, row_files, weighted)
+        np.add.at(totals, row_files, present)
+        return sums, totals, categories, files
+
+    @staticmethod
+    def _means(sums, totals, categories, names):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = sums / totals
+        rollup = {}
+        for i, name in enumerate(names):
+            row = {category: round(float(means[i, j]), 2) for j, category in enumerate(categories) if totals[i, j] > 0}
+            if row:
+                rollup[name] = row
+        return rollup
+
+    def rollup_files(self):
+        return self._means(*self._file_sums())
+
+    def rollup_directories(self):
+        # every ancestor directory, so a top-level folder includes everything below it
+        sums, totals, categories, files = self._file_sums()
+        directories, index, pairs = [], {}, []
+        for file_row, file in enumerate(files):
+            for directory in ancestors(file):
+                if directory not in index:
+                    index[directory] = len(directories)
+                    directories.append(directory)
+                pairs.append((index[directory], file_row))
+        directory_sums = np.zeros((len(directories), len(categories)))
+        directory_totals = np.zeros((len(directories), len(categories)))
+        if pairs:
+            targets, sources = np.array(pairs).T
+            np.add.at(directory_sums, targets, sums[sources])
+            np.add.at(directory_totals, targets, totals[sources])
+        return self._means(directory_sums, directory_totals, categories, directories)
+
+    def to_summary(self):
+        summary = self.summary()
+        overall = [stats["mean"] for stats in summary.values()]
+        return {
+            "scores_by_category": {category: stats["mean"] for category, stats in summary.items()},
+            "overall": round(float(np.mean(overall)), 2) if overall else None,
+            "chunks": len(self),
+            "statistics": summary,
+            "files": self.rollup_files(),
+            "directories": self.rollup_directories(),
+        }
+
+    def save(self, path: str):
+        scores, weights, row_files, categories, files = self._snapshot()
+        with self.lock:
+            rows = dict(self.rows)
+        np.savez_compressed(
+            path, scores=scores, weights=weights, row_files=row_files,
+            meta=np.array(json.dumps({"categories": categories, "files": files, "rows": rows})),
+        )
+
+    @classmethod
+    def load(cls, path: str):
+        aggregator = cls()
+        with np.load(path) as state:
+            meta = json.loads(str(state["meta"]))
+            aggregator.categories = meta["categories"]
+            aggregator.columns = {category: i for i, category in enumerate(aggregator.categories)}
+            aggregator.files = meta["files"]
+            aggregator.file_index = {file: i for i, file in enumerate(aggregator.files)}
+            aggregator.rows = meta["rows"]
+            aggregator.size = len(state["weights"])
+            aggregator._grow(aggregator.size, len(aggregator.categories))
+            aggregator.scores[:aggregator.size, :len(aggregator.categories)] = state["scores"]
+            aggregator.weights[:aggregator.size] = state["weights"]
+            aggregator.row_files[:aggregator.size] = state["row_files"]
+        return aggregator
+
+
+def rank_repositories(summaries: dict, category: str = None):
+    # summaries: {repo: scores_summary dict}; ranks by one category's mean or by the overall mean
+    names = [name for name, summary in summaries.items() if summary]
+    values = np.array([
+        (summary.get("scores_by_category", {}).get(category) if category else summary.get("overall"))
+        for summary in (summaries[name] for name in names)
+    ], dtype=np.float64)
+    values = np.where(np.isnan(values), -np.inf, values)
+    order = np.argsort(-values, kind="stable")
+    return [
+        {"rank": rank, "repo": names[i], "score": None if np.isinf(values[i]) else float(values[i])}
+        for rank, i in enumerate(order, 1)
+    ]
+
+
+def leaderboard(summaries: dict):
+    # overall ranking, with every category's score and rank alongside
+    categories = sorted({category for summary in summaries.values() if summary for category in summary.get("scores_by_category", {})})
+    category_ranks = {category: {row["repo"]: row["rank"] for row in rank_repositories(summaries, category)} for category in categories}
+    return [
+        {
+            **row,
+            "scores": (summaries[row["repo"]] or {}).get("scores_by_category", {}),
+            "category_ranks": {category: category_ranks[category][row["repo"]] for category in categories},
+        }
+        for row in rank_repositories(summaries)
+    ]
@@ -0,0 +1,126 @@
+import re
+import threading
+from collections import Counter
+from .chunk_store import Chunk
+
+# the same grammars CodeSplitter loads; without them the metrics fall back to line heuristics
+try:
+    from tree_sitter_languages import get_parser
+except ImportError:
+    get_parser = None
+
+# config and markup that has no control flow worth a code review
+DATA_LANGUAGES = {"json", "yaml", "toml", "css", "html", "sql", "dot", "gomod", "restructuredtext (rst)"}
+BRANCH_NODES = {
+    "if_statement", "elif_clause", "else_if_clause", "if_expression", "conditional_expression", "ternary_expression",
+    "for_statement", "for_in_statement", "for_range_loop", "enhanced_for_statement", "for_expression", "for_clause",
+    "while_statement", "while_expression", "do_statement", "loop_expression",
+    "case_clause", "switch_case", "switch_block_statement_group", "expression_case", "match_arm", "when_entry",
+    "catch_clause", "except_clause", "rescue", "if_clause", "boolean_operator",
+}
+LOGICAL_OPERATORS = {"&&", "||", "and", "or"}
+NESTING_NODES = {
+    "if_statement", "if_expression", "for_statement", "for_in_statement", "for_range_loop", "enhanced_for_statement",
+    "for_expression", "while_statement", "while_expression", "do_statement", "loop_expression", "try_statement",
+    "with_statement", "switch_statement", "match_statement", "match_expression", "case_statement",
+}
+FUNCTION_NODES = {
+    "function_definition", "function_declaration", "function_item", "function_expression", "method_definition",
+    "method_declaration", "constructor_declaration", "arrow_function", "func_literal", "method",
+}
+GENERATED_MARKERS = re.compile(r"@generated|do not edit|auto-?generated|code generated by", re.IGNORECASE)
+LINE_COMMENT = re.compile(r"^\s*(#|//|/\*|\*|--|;|<!--)")
+BRANCH_KEYWORDS = re.compile(r"\b(if|elif|else if|for|foreach|while|case|catch|except|when)\b|&&|\|\|")
+HEADER_LINES = 5
+
+_local = threading.local()
+
+
+def parser_for(language: str):
+    # tree-sitter parsers are not thread safe, every worker thread keeps its own
+    if get_parser is None:
+        return None
+    parsers = getattr(_local, "parsers", None)
+    if parsers is None:
+        parsers = _local.parsers = {}
+    if language not in parsers:
+        try:
+            parsers[language] = get_parser(language)
+        except Exception:
+            parsers[language] = None
+    return parsers[language]
+
+
+def duplication_ratio(lines) -> float:
+    # share of non-trivial lines that repeat another line of the same chunk
+    counts = Counter(line.strip() for line in lines if len(line.strip()) > 8)
+    total = sum(counts.values())
+    if not total:
+        return 0.0
+    return round(sum(count for count in counts.values() if count > 1) / total, 3)
+
+
+def tree_metrics(root, comment_lines: set) -> dict:
+    complexity, max_depth, functions, longest = 1, 0, 0, 0
+    stack = [(root, 0)]
+    while stack:
+        node, depth = stack.pop()
+        kind = node.type
+        if "comment" in kind:
+            comment_lines.update(range(node.start_point[0], node.end_point[0] + 1))
+            continue
+        if kind == "expression_statement" and node.named_child_count == 1 and node.named_children[0].type == "string":
+            # docstrings
+            comment_lines.update(range(node.start_point[0], node.end_point[0] + 1))
+            continue
+        if kind in BRANCH_NODES:
+            complexity += 1
+        elif kind == "binary_expression" and any(child.type in LOGICAL_OPERATORS for child in node.children):
+            complexity += 1
+        if kind in NESTING_NODES:
+            depth += 1
+            max_depth = max(max_depth, depth)
+        if kind in FUNCTION_NODES:
+            functions += 1
+            longest = max(longest, node.end_point[0] - node.start_point[0] + 1)
+        stack.extend((child, depth) for child in node.children)
+    return {"cyclomatic_complexity": complexity, "max_nesting": max_depth, "functions": functions, "max_function_lines": longest}
+
+
+def heuristic_metrics(lines, comment_lines: set) -> dict:
+    complexity, max_depth, indents = 1, 0, sorted({len(line) - len(line.lstrip()) for line in lines if line.strip()})
+    for number, line in enumerate(lines):
+        if LINE_COMMENT.match(line):
+            comment_lines.add(number)
+            continue
+        complexity += len(BRANCH_KEYWORDS.findall(line))
+    if len(indents) > 1:
+        max_depth = len(indents) - 1
+    return {"cyclomatic_complexity": complexity, "max_nesting": max_depth, "functions": None, "max_function_lines": None}
+
+
+def static_metrics(chunk: Chunk) -> dict:
+    text = chunk.text
+    lines = text.splitlines()
+    comment_lines = set()
+    parser = None if chunk.language in DATA_LANGUAGES else parser_for(chunk.language)
+    if chunk.language in DATA_LANGUAGES:
+        comment_lines.update(number for number, line in enumerate(lines) if LINE_COMMENT.match(line))
+        structure = {"cyclomatic_complexity": 1, "max_nesting": 0, "functions": 0, "max_function_lines": 0}
+    elif parser is not None:
+        structure = tree_metrics(parser.parse(text.encode("utf-8")).root_node, comment_lines)
+    else:
+        structure = heuristic_metrics(lines, comment_lines)
+    blank = sum(1 for line in lines if not line.strip())
+    comments = len(comment_lines)
+    code = max(len(lines) - blank - comments, 0)
+    return {
+        "lines": len(lines),
+        "code_lines": code,
+        "comment_lines": comments,
+        "comment_ratio": round(comments / max(code + comments, 1), 3),
+        **structure,
+        "duplication": duplication_ratio(lines),
+        "generated": bool(GENERATED_MARKERS.search("\n".join(lines[:HEADER_LINES]))),
+        "parser": "tree-sitter" if parser is not None else ("none" if chunk.language in DATA_LANGUAGES else "heuristic"),
+    }
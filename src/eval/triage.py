@@ -0,0 +1,61 @@
+from .static_metrics import DATA_LANGUAGES
+
+LOCAL = "local"
+CHEAP = "cheap"
+LLM = "llm"
+TRIVIAL_LINES = 5
+CHEAP_COMPLEXITY = 5
+CHEAP_NESTING = 2
+CHEAP_LINES = 60
+LOCAL_REMARKS = "Scored locally from static metrics, no model review"
+
+
+def clamp_score(value: float) -> int:
+    return int(min(10, max(1, round(value))))
+
+
+class TriagePolicy:
+    # decides per chunk whether it is scored locally, by the cheap model or by the full model
+    def __init__(self, trivial_lines: int = TRIVIAL_LINES, cheap_complexity: int = CHEAP_COMPLEXITY,
+                 cheap_nesting: int = CHEAP_NESTING, cheap_lines: int = CHEAP_LINES):
+        self.trivial_lines = trivial_lines
+        self.cheap_complexity = cheap_complexity
+        self.cheap_nesting = cheap_nesting
+        self.cheap_lines = cheap_lines
+
+    def trivial(self, metrics: dict) -> bool:
+        # generated stubs, a handful of lines, or straight-line code such as constants and re-exports
+        return (metrics["generated"] or metrics["code_lines"] < self.trivial_lines
+                or (metrics["cyclomatic_complexity"] <= 1 and not metrics["functions"] and metrics["max_nesting"] == 0))
+
+    def simple(self, metrics: dict) -> bool:
+        return (metrics["cyclomatic_complexity"] <= self.cheap_complexity and metrics["max_nesting"] <= self.cheap_nesting
+                and metrics["code_lines"] <= self.cheap_lines)
+
+    def decide(self, language: str, metrics: dict, analysis_mode: str) -> str:
+        if analysis_mode in ("code_descriptor", "code_security"):
+            # a description cannot come from metrics, and neither can hardcoded secrets or unsafe settings, which
+            # straight-line config and constants are full of; the small model is still good enough for small chunks
+            return CHEAP if language in DATA_LANGUAGES or self.trivial(metrics) or self.simple(metrics) else LLM
+        if language in DATA_LANGUAGES or self.trivial(metrics):
+            return LOCAL
+        return CHEAP if self.simple(metrics) else LLM
+
+
+def local_scores(metrics: dict) -> dict:
+    nesting_penalty = max(0, metrics["max_nesting"] - 2)
+    long_functions = 1 if (metrics["max_function_lines"] or 0) > CHEAP_LINES else 0
+    return {
+        "readability": clamp_score(9 - 1.5 * nesting_penalty - long_functions - 4 * metrics["duplication"]),
+        "maintainability": clamp_score(9 - max(0, metrics["cyclomatic_complexity"] - 10) / 3 - nesting_penalty - 5 * metrics["duplication"]),
+        "consistency": clamp_score(8 - 4 * metrics["duplication"]),
+        "commenting": clamp_score(2 + 40 * metrics["comment_ratio"]),
+        "complexity_score": clamp_score(1 + metrics["cyclomatic_complexity"] / 3),
+        "technical_complexity": clamp_score(1 + metrics["cyclomatic_complexity"] / 3 + metrics["max_nesting"]),
+    }
+
+
+def local_output(metrics: dict, response_model) -> dict:
+    # only the categories the metrics can speak for; the rest stay out of the aggregates instead of guessing
+    fields = response_model.model_fields
+    return {category: {"score": score, "remarks": LOCAL_REMARKS} for category, score in local_scores(metrics).items() if category in fields}
@@ -0,0 +1,24 @@
+from pydantic import BaseModel, Field, create_model
+from typing import List, Type
+
+
+def batch_response_model(response_model: Type[BaseModel]) -> Type[BaseModel]:
+    item_model = create_model(
+        f"{response_model.__name__}BatchItem",
+        chunk_id=(str, Field(..., description="The id attribute of the chunk this review is for")),
+        result=(response_model, ...),
+    )
+    return create_model(
+        f"{response_model.__name__}Batch",
+        results=(List[item_model], Field(..., description="One review per chunk, in the order the chunks were given")),
+    )
+
+
+sys_prompt_suffix = """
+
+## Batched Input:
+The user message contains several independent code chunks, each wrapped in <chunk id="..." file="..."> ... </chunk>.
+- Review every chunk on its own, as if it were the only code you were given.
+- Return exactly one entry per chunk in "results", copying the chunk's id into "chunk_id".
+- Do not merge chunks, skip chunks or invent ids.
+"""
@@ -0,0 +1,26 @@
+from pydantic import BaseModel, Field, create_model
+from typing import Type
+
+
+class ScoreModel(BaseModel):
+    score: int = Field(..., ge=1, le=10, description="Score from 1 to 10")
+
+
+def compact_response_model(response_model: Type[BaseModel]) -> Type[BaseModel]:
+    # the scored categories only, each cut down to its integer score
+    fields = {
+        name: (ScoreModel, ...)
+        for name, field in response_model.model_fields.items()
+        if isinstance(field.annotation, type) and issubclass(field.annotation, BaseModel) and "score" in field.annotation.model_fields
+    }
+    return create_model(f"{response_model.__name__}Scores", **fields)
+
+
+sys_prompt_suffix = """
+
+## Compact Output:
+This replaces the output format above. Evaluate the code exactly as described, but return only the integer
+score for each category, as {"score": n}.
+- Do not write remarks, strengths, weaknesses, improvement suggestions or final remarks.
+- Do not add any prose or fields beyond the scores.
+"""
@@ -3,11 +3,43 @@ from pydantic import BaseModel
 from typing import Dict, List, Optional, Union, Any
 
 class AnalysisRequest(BaseModel):
+    url: str
     analysis_type: str
+    batch_tokens: Optional[int] = None
+    dedup: bool = True
+    triage: bool = False
+    compact: bool = False
+    max_calls: Optional[int] = None
+    ci_width: Optional[float] = None
+    sample_calls: Optional[int] = None
+
+class MultiAnalysisRequest(BaseModel):
+    url: str
+    analysis_types: List[str]
+    combined: bool = False
+    compact: bool = False
+
+class BatchRequest(BaseModel):
+    urls: List[str]
+    analysis_type: str
+    scheduling: str = "round_robin"
+    checkout: bool = True
+    dedup: bool = True
+    triage: bool = False
+    compact: bool = False
+    max_calls: Optional[int] = None
+    ci_width: Optional[float] = None
+    sample_calls: Optional[int] = None
+
+class RemarksRequest(BaseModel):
+    url: str
+    analysis_type: str
+    chunk_ids: List[str]
 
 class AnalysisResponse(BaseModel):
     analysis_type: str
     results: Dict[str, Any]
 
 class Init(BaseModel):
-    url: str
\ No newline at end of file
+    url: str
+    checkout: bool = True
\ No newline at end of file
@@ -0,0 +1,38 @@
+from pydantic import BaseModel, Field
+
+
+class DigestModel(BaseModel):
+    digest: str = Field(..., description="Dense summary of everything given, at most 200 words")
+
+
+leaf_prompt = """
+You are summarising part of a code repository for a senior reviewer who will never see the code itself.
+The user message contains one or more files, each wrapped in <file path="..."> ... </file>. Long files are cut
+short and marked as truncated.
+
+Write a single digest of at most 200 words that covers, for these files together:
+- what the code does and its main components
+- external libraries and services it depends on
+- concrete quality signals: structure, naming, comments, error handling, tests
+- concrete security signals: input validation, secrets, authentication, unsafe calls
+
+Be specific and factual, name files and functions where it helps, and do not give scores.
+"""
+
+merge_prompt = """
+You are condensing a code repository for a senior reviewer who will never see the code itself.
+The user message contains digests of neighbouring parts of the repository, each wrapped in
+<digest scope="..."> ... </digest>, where scope is the directory it covers.
+
+Merge them into a single digest of at most 200 words for the combined scope. Keep every concrete quality
+and security finding that matters for judging the repository as a whole, drop repetition and minor detail,
+and do not give scores.
+"""
+
+repo_prompt_suffix = """
+
+## Repository-level Input:
+Instead of code, the user message contains digests that together cover the whole repository, each wrapped in
+<digest scope="..."> ... </digest>. Judge the repository as a whole from these digests, applying the criteria
+above to what they report, and do not penalise the absence of code excerpts.
+"""